@@ -0,0 +1,83 @@
+'''Хэширование паролей в потоке запроса и в пуле процессов.
+
+Несколько потоков непрерывно проверяют пароль (как поток входов), а один поток "игры"
+выполняет небольшую работу на Python, как обработка раунда, и замеряет ее задержку.
+Для каждого числа процессов из --workers (0 - хэш считается в самом потоке) выводится
+число проверок в секунду, их задержка и задержка "игры" p50/p95/p99.
+
+Запуск: python -m benchmarks.bench_passwords --method scrypt --workers 0 1 2 4 --threads 8 --duration 10
+'''
+import argparse
+import random
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from benchmarks.bench_routes import percentile
+from data.passwords import PasswordHasher
+from data.scoring import getdistance, round_score
+
+PASSWORD = 'bench-password'
+
+
+def game_work(rnd):
+    '''Примерно столько работы на Python делает один раунд игры'''
+    total = 0
+    for _ in range(200):
+        total += round_score(getdistance([rnd.uniform(43, 60), rnd.uniform(30, 60)],
+                                         [rnd.uniform(43, 60), rnd.uniform(30, 60)]))
+    return total
+
+
+def run(method, workers, threads, duration):
+    hasher = PasswordHasher(method, workers, max_pending=threads)
+    hashed = generate_password_hash(PASSWORD, method)
+    hasher.check(hashed, PASSWORD)  # запуск процессов пула не входит в замер
+    deadline = time.perf_counter() + duration
+    check_timings, game_timings = [], []
+    lock = threading.Lock()
+
+    def login():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            hasher.check(hashed, PASSWORD)
+            with lock:
+                check_timings.append(time.perf_counter() - start)
+
+    def game():
+        rnd = random.Random(0)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            game_work(rnd)
+            game_timings.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    pool = [threading.Thread(target=login) for _ in range(threads)] + [threading.Thread(target=game)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    hasher.shutdown()
+    return check_timings, game_timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Хэширование паролей в потоке запроса и в пуле процессов')
+    parser.add_argument('--method', default='scrypt')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--threads', type=int, default=8, help='одновременных входов')
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    print(f'{"процессов":>9} {"проверок/с":>11} {"p50 мс":>9} {"p95 мс":>9} '
+          f'{"игра p50":>9} {"игра p95":>9} {"игра p99":>9}')
+    for workers in args.workers:
+        checks, games = run(args.method, workers, args.threads, args.duration)
+        ms = [percentile(values, p) * 1000 for values in (checks, games) for p in (50, 95, 99)]
+        print(f'{workers:9} {len(checks) / args.duration:11.1f} {ms[0]:9.1f} {ms[1]:9.1f} '
+              f'{ms[3]:9.2f} {ms[4]:9.2f} {ms[5]:9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+'''Нагрузочный тест маршрутов приложения.
+
+Создает временную базу SQLite с заданным числом пользователей, точек, игр и раундов,
+запускает несколько одновременных игроков и замеряет каждый маршрут:
+/game (раунды целиком), /global_rating/<n>, /personal_page, /admin/<n> с поиском и /login.
+Игроки ходят через тестовый клиент Flask или, с флагом --server, по HTTP к локальному серверу.
+Результаты (запросов в секунду, p50/p95/p99) сохраняются в benchmarks/results/ в json,
+а с --compare сравниваются с прошлым запуском.
+
+Запуск: python -m benchmarks.bench_routes --users 50000 --players 40 --duration 30
+'''
+import argparse
+import datetime
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+from werkzeug.security import generate_password_hash
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+PASSWORD = 'bench-password'
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def seed(db_file, users, points, games, players, chunk=10000):
+    '''Заполняет базу. Первые players пользователей - игроки теста (администраторы с настоящим паролем),
+    у остальных пароль не проверяется, поэтому хэш у них фиктивный.'''
+    from data import db_session
+    from data.games import Games
+    from data.panorama_points import PanoramaPoints
+    from data.rounds import Rounds
+    from data.users import User
+
+    db_session.global_init(db_file)
+    rnd = random.Random(0)
+    db_sess = db_session.create_session()
+    try:
+        real_hash = generate_password_hash(PASSWORD)
+        batch = []
+        for user_id in range(1, users + 1):
+            player = user_id <= players
+            batch.append({'id': user_id, 'nickname': f'nick{user_id}', 'login': f'login{user_id}',
+                          # hashed_password уникален в таблице
+                          'hashed_password': real_hash + f'${user_id}' if not player else None,
+                          'rating': rnd.randint(0, 5000), 'matches_number': rnd.randint(0, 300),
+                          'is_admin': player})
+            if len(batch) >= chunk:
+                db_sess.bulk_insert_mappings(User, batch)
+                batch = []
+        db_sess.bulk_insert_mappings(User, batch)
+        db_sess.commit()
+        # настоящие хэши игроков (пароль одинаковый, а соль у каждого своя)
+        db_sess.bulk_update_mappings(User, [{'id': user_id, 'hashed_password': generate_password_hash(PASSWORD)}
+                                            for user_id in range(1, players + 1)])
+        db_sess.commit()
+
+        db_sess.bulk_insert_mappings(PanoramaPoints, [{'y': rnd.uniform(43, 60), 'x': rnd.uniform(30, 60)}
+                                                      for _ in range(points)])
+        db_sess.commit()
+
+        rounds, game_rows = [], []
+        for game_id in range(1, games + 1):
+            for round_index in range(5):
+                rounds.append({'game_id': game_id, 'round_index': round_index,
+                               'start_lat': rnd.uniform(43, 60), 'start_lon': rnd.uniform(30, 60),
+                               'input_lat': rnd.uniform(43, 60), 'input_lon': rnd.uniform(30, 60),
+                               'rating': rnd.randint(0, 1000)})
+            game_rows.append({'id': game_id, 'rating': rnd.randint(0, 5000),
+                              # большая часть игр у игроков теста, чтобы личная страница была тяжелой
+                              'user_id': rnd.randint(1, players) if rnd.random() < 0.5 else rnd.randint(1, users),
+                              'modifed_date': datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=game_id)})
+            if len(rounds) >= chunk:
+                db_sess.bulk_insert_mappings(Games, game_rows)
+                db_sess.bulk_insert_mappings(Rounds, rounds)
+                db_sess.commit()
+                rounds, game_rows = [], []
+        db_sess.bulk_insert_mappings(Games, game_rows)
+        db_sess.bulk_insert_mappings(Rounds, rounds)
+        db_sess.commit()
+    finally:
+        db_sess.close()
+
+
+class TestClient:
+    '''Клиент через app.test_client(). У каждого игрока свой клиент со своими cookie'''
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def get(self, path):
+        response = self._client.get(path)
+        return response.status_code, response.get_data(as_text=True)
+
+    def post(self, path, data):
+        response = self._client.post(path, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class HttpClient:
+    '''Клиент по HTTP к локальному серверу. Перенаправления не выполняются, как и у тестового клиента'''
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect)
+
+    def _open(self, request):
+        try:
+            with self._opener.open(request) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode()
+
+    def get(self, path):
+        return self._open(urllib.request.Request(self.base_url + path))
+
+    def post(self, path, data):
+        return self._open(urllib.request.Request(self.base_url + path, urllib.parse.urlencode(data).encode()))
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, route, method, *args):
+        start = time.perf_counter()
+        status, body = method(*args)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.timings[route].append(elapsed)
+            if status >= 400:
+                self.errors[route] += 1
+        return body
+
+
+def csrf(body):
+    match = CSRF_RE.search(body)
+    return {'csrf_token': match.group(1)} if match else {}
+
+
+def player(client, login_client, player_id, recorder, deadline, pages):
+    rnd = random.Random(player_id)
+    body = recorder.call('GET /login', client.get, '/login')
+    recorder.call('POST /login', client.post, '/login',
+                  {'login': f'login{player_id}', 'password': PASSWORD, **csrf(body)})
+    while time.perf_counter() < deadline:
+        for _ in range(5):
+            body = recorder.call('GET /game', client.get, '/game')
+            recorder.call('POST /game', client.post, '/game',
+                          {'rating': f'{rnd.uniform(43, 60)}, {rnd.uniform(30, 60)}', **csrf(body)})
+        recorder.call('GET /global_rating/<n>', client.get, f'/global_rating/{rnd.randrange(pages)}')
+        recorder.call('GET /personal_page', client.get, '/personal_page')
+        recorder.call('GET /admin/<n> search', client.get,
+                      f'/admin/0?nickname=nick{rnd.randint(1, 99)}&rating={rnd.randint(1, 9)}')
+        body = login_client.get('/login')[1]
+        recorder.call('POST /login', login_client.post, '/login',
+                      {'login': f'login{player_id}', 'password': PASSWORD, **csrf(body)})
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for route, timings in sorted(recorder.timings.items()):
+        routes[route] = {'requests': len(timings), 'errors': recorder.errors[route],
+                         'rps': len(timings) / elapsed,
+                         'p50_ms': percentile(timings, 50) * 1000,
+                         'p95_ms': percentile(timings, 95) * 1000,
+                         'p99_ms': percentile(timings, 99) * 1000}
+    return routes
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(routes, previous=None):
+    print(f'{"маршрут":28} {"запросов":>9} {"ошибок":>7} {"rps":>8} {"p50 мс":>9} {"p95 мс":>9} {"p99 мс":>9}')
+    for route, r in routes.items():
+        line = (f'{route:28} {r["requests"]:9} {r["errors"]:7} {r["rps"]:8.1f} '
+                f'{r["p50_ms"]:9.2f} {r["p95_ms"]:9.2f} {r["p99_ms"]:9.2f}')
+        old = (previous or {}).get(route)
+        if old:
+            line += f'   p95 {(r["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100:+.0f}%'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест маршрутов')
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--games', type=int, default=20000)
+    parser.add_argument('--players', type=int, default=40, help='одновременных игроков')
+    parser.add_argument('--duration', type=float, default=30, help='секунд нагрузки')
+    parser.add_argument('--server', action='store_true', help='ходить по HTTP к локальному серверу')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--compare', help='json прошлого запуска для сравнения')
+    parser.add_argument('--out', help='куда сохранить json (по умолчанию benchmarks/results/<время>.json)')
+    args = parser.parse_args()
+    args.players = min(args.players, args.users)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'bench.sqlite')
+        print('Заполнение базы...')
+        seed(db_file, args.users, args.points, args.games, args.players)
+        import main as panorama
+        app = panorama.create_app(db_file)
+        app.config['WTF_CSRF_ENABLED'] = False
+
+        server = None
+        if args.server:
+            from werkzeug.serving import make_server
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)
+            server = make_server('127.0.0.1', args.port, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            make_client = lambda: HttpClient(f'http://127.0.0.1:{args.port}')
+        else:
+            make_client = lambda: TestClient(app)
+
+        recorder = Recorder()
+        pages = max(1, args.users // 20)
+        start = time.perf_counter()
+        deadline = start + args.duration
+        threads = [threading.Thread(target=player, args=(make_client(), make_client(), player_id, recorder,
+                                                          deadline, pages))
+                   for player_id in range(1, args.players + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if server:
+            server.shutdown()
+
+    routes = summarize(recorder, elapsed)
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)['routes']
+    print_report(routes, previous)
+
+    result = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'revision': git_revision(),
+              'params': vars(args), 'elapsed': elapsed, 'routes': routes}
+    out = args.out
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(out, 'w') as file:
+        json.dump(result, file, indent=2, ensure_ascii=False)
+    print(f'Результаты сохранены в {out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''Сравнение памяти таблицы лидеров: старый список кортежей со строками
+(как было в scheduled/update_top.py) и столбцовое хранилище data/leaderboard.py.
+
+Запуск: python -m benchmarks.leaderboard_memory [--users 50000 1000000]
+'''
+import argparse
+import random
+import string
+import tracemalloc
+
+from data.leaderboard import Leaderboard
+
+
+def fake_users(n, seed=0):
+    rnd = random.Random(seed)
+    letters = string.ascii_lowercase + string.digits
+    for user_id in range(1, n + 1):
+        yield (user_id, ''.join(rnd.choices(letters, k=rnd.randint(4, 12))),
+               ''.join(rnd.choices(letters, k=rnd.randint(5, 14))), rnd.randint(0, 5000), rnd.randint(0, 300))
+
+
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def tuple_list(n):
+    rating_list = [(nickname, str(rating), str(matches_number), login, user_id)
+                   for user_id, nickname, login, rating, matches_number in fake_users(n)]
+    rating_list.sort(key=lambda x: (-int(x[1]), int(x[2])))
+    return rating_list
+
+
+def columnar(n):
+    leaderboard = Leaderboard()
+    leaderboard.rebuild(fake_users(n))
+    return leaderboard
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Память таблицы лидеров')
+    parser.add_argument('--users', type=int, nargs='+', default=[50000, 1000000])
+    args = parser.parse_args()
+    for n in args.users:
+        _, old_size = measure(lambda: tuple_list(n))
+        leaderboard, new_size = measure(lambda: columnar(n))
+        print(f'{n} пользователей:')
+        print(f'  список кортежей: {old_size / 2 ** 20:8.1f} МиБ ({old_size / n:.0f} байт на пользователя)')
+        print(f'  столбцы:         {new_size / 2 ** 20:8.1f} МиБ ({new_size / n:.0f} байт на пользователя)')
+        for name, size in leaderboard.memory_usage().items():
+            print(f'    {name:10} {size / 2 ** 20:8.1f} МиБ')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 from . import users
 from . import rounds
 from . import games
-from . import panorama_points
\ No newline at end of file
+from . import panorama_points
+from . import user_stats
\ No newline at end of file
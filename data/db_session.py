@@ -2,14 +2,48 @@ import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
 import sqlalchemy.ext.declarative as dec
+from flask import g
 
 SqlAlchemyBase = dec.declarative_base()
 
 __factory = None
+__read_factory = None
+__engine = None
+__read_engine = None
 
+# Настройки SQLite для каждого нового соединения.
+# WAL позволяет читать базу во время записи, synchronous=NORMAL в режиме WAL делает fsync
+# только при чекпоинте, cache_size в отрицательных значениях задается в КиБ.
+# auto_vacuum действует только для новой базы: место после удаления старых игр
+# возвращается понемногу через PRAGMA incremental_vacuum (см. scheduled/compact_history.py).
+PRAGMAS = {
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
 
-def global_init(db_file):
-    global __factory
+
+def _set_pragmas(read_only):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in PRAGMAS.items():
+            if read_only and name in ('journal_mode', 'auto_vacuum'):
+                # режим журнала и очистки меняет только пишущее соединение
+                continue
+            cursor.execute(f'PRAGMA {name}={value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+    return on_connect
+
+
+def global_init(db_file, pool_size=5, max_overflow=10, pool_timeout=30, read_pool_size=10):
+    global __factory, __read_factory, __engine, __read_engine
 
     if __factory:
         return
@@ -20,14 +54,71 @@ def global_init(db_file):
     conn_str = f'sqlite:///{db_file.strip()}?check_same_thread=False'
     print(f"Подключение к базе данных по адресу {conn_str}")
 
-    engine = sa.create_engine(conn_str, echo=False)
+    engine = sa.create_engine(conn_str, echo=False, poolclass=sa.pool.QueuePool, pool_size=pool_size,
+                              max_overflow=max_overflow, pool_timeout=pool_timeout)
+    sa.event.listen(engine, 'connect', _set_pragmas(read_only=False))
+    __engine = engine
     __factory = orm.sessionmaker(bind=engine)
 
     from . import __all_models
 
     SqlAlchemyBase.metadata.create_all(engine)
+    create_indexes(engine)
+
+    # Отдельный пул соединений только для чтения: тяжелые чтения не занимают соединения,
+    # через которые пишутся игры, а в режиме WAL не мешают записи.
+    read_engine = sa.create_engine(f'sqlite:///file:{db_file.strip()}?mode=ro&uri=true&check_same_thread=False',
+                                   echo=False, poolclass=sa.pool.QueuePool, pool_size=read_pool_size,
+                                   max_overflow=max_overflow, pool_timeout=pool_timeout)
+    sa.event.listen(read_engine, 'connect', _set_pragmas(read_only=True))
+    __read_engine = read_engine
+    __read_factory = orm.sessionmaker(bind=read_engine)
+
+
+def create_indexes(engine):
+    '''create_all не добавляет новые индексы к уже существующим таблицам, поэтому они создаются отдельно.
+    Если в старой базе еще нет нужных столбцов, индекс создастся после миграции'''
+    for table in SqlAlchemyBase.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(engine, checkfirst=True)
+            except sa.exc.OperationalError as e:
+                print(f"Не удалось создать индекс {index.name}: {e.orig}. "
+                      f"Возможно, нужна миграция (python -m scheduled.migrate_rounds)")
+
+
+def get_engine():
+    return __engine
+
+
+def get_read_engine():
+    return __read_engine
 
 
 def create_session() -> Session:
+    '''Новая сессия. Закрывать ее должен вызывающий код (фоновые задачи, скрипты)'''
     global __factory
     return __factory()
+
+
+def request_session() -> Session:
+    '''Сессия текущего запроса. Создается при первом обращении и закрывается после запроса
+    (см. close_request_sessions)'''
+    if 'db_session' not in g:
+        g.db_session = __factory()
+    return g.db_session
+
+
+def read_session() -> Session:
+    '''Сессия текущего запроса только для чтения'''
+    if 'db_read_session' not in g:
+        g.db_read_session = __read_factory()
+    return g.db_read_session
+
+
+def close_request_sessions(exception=None):
+    '''Закрывает сессии запроса. Регистрируется через app.teardown_appcontext'''
+    for name in ('db_session', 'db_read_session'):
+        db_sess = g.pop(name, None)
+        if db_sess is not None:
+            db_sess.close()
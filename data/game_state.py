@@ -0,0 +1,147 @@
+'''Состояние идущих игр на стороне сервера.
+
+В cookie сессии хранится только ключ игры, а раунды, счет и точки игры лежат в хранилище.
+Точки всех пяти раундов выбираются при старте игры, дальше каждый раунд - чтение по ключу.
+Хранилища:
+    MemoryStore - словарь в памяти процесса. Подходит для одного процесса (сервер разработки).
+    SqliteStore - отдельный файл SQLite с таблицей ключ-значение. Его видят все процессы-обработчики,
+    поэтому игрок может попадать в разные процессы между раундами.
+Записи без обращений дольше ttl секунд удаляются.
+Оба хранилища отдают копию состояния. Изменение записывается через replace только при том же номере раунда,
+что был прочитан, поэтому при двойной отправке формы раунд засчитывается один раз.
+'''
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryStore:
+    '''Состояния хранятся в json, как в SqliteStore: каждый запрос получает свою копию'''
+
+    def __init__(self, ttl=3600, maxsize=100000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # ключ -> (время истечения, состояние в json), старые записи в начале
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < now:
+                return None
+        return json.loads(item[1])
+
+    def set(self, key, state):
+        now = time.monotonic()
+        with self._lock:
+            self._set(key, json.dumps(state), now)
+
+    def replace(self, key, state, round_index):
+        '''Записывает state, только если у сохраненного состояния номер раунда round_index'''
+        now = time.monotonic()
+        state = json.dumps(state)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < now or json.loads(item[1])['round'] != round_index:
+                return False
+            self._set(key, state, now)
+            return True
+
+    def _set(self, key, state, now):
+        self._items[key] = (now + self.ttl, state)
+        self._items.move_to_end(key)
+        # записи упорядочены по времени истечения, поэтому просроченные лежат в начале
+        while self._items and (len(self._items) > self.maxsize or next(iter(self._items.values()))[0] < now):
+            self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SqliteStore:
+    '''Ключ-значение в файле SQLite (состояние хранится в json). Одно соединение на поток'''
+
+    def __init__(self, path, ttl=3600, purge_interval=60):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._purged = 0
+        self._connection().execute('CREATE TABLE IF NOT EXISTS game_state '
+                                   '(key TEXT PRIMARY KEY, expires REAL, state TEXT) WITHOUT ROWID')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute('SELECT state FROM game_state WHERE key = ? AND expires >= ?',
+                                         (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, state):
+        now = time.time()
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO game_state VALUES (?, ?, ?)',
+                           (key, now + self.ttl, json.dumps(state)))
+        if now - self._purged > self.purge_interval:
+            self._purged = now
+            connection.execute('DELETE FROM game_state WHERE expires < ?', (now,))
+
+    def replace(self, key, state, round_index):
+        '''Записывает state, только если у сохраненного состояния номер раунда round_index.
+        Проверка и запись - один UPDATE, поэтому из разных процессов запишет только один'''
+        now = time.time()
+        cursor = self._connection().execute(
+            "UPDATE game_state SET expires = ?, state = ? "
+            "WHERE key = ? AND expires >= ? AND json_extract(state, '$.round') = ?",
+            (now + self.ttl, json.dumps(state), key, now, round_index))
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM game_state WHERE key = ?', (key,))
+
+    def __len__(self):
+        return self._connection().execute('SELECT count(*) FROM game_state').fetchone()[0]
+
+
+class GameStates:
+    '''Игры по ключу. Состояние игры - словарь:
+    points - точки раундов [id, широта, долгота], round - номер текущего раунда, с нуля,
+    score - счет, rounds - сыгранные раунды [широта цели, долгота цели, широта ответа, долгота ответа, очки, id точки]'''
+
+    def __init__(self, store):
+        self.store = store
+
+    def start(self, points):
+        key = secrets.token_urlsafe(16)
+        state = {'points': [list(point) for point in points], 'round': 0, 'score': 0, 'rounds': []}
+        self.store.set(key, state)
+        return key, state
+
+    def get(self, key):
+        if not key:
+            return None
+        return self.store.get(key)
+
+    def advance(self, key, state, round_index):
+        '''Записывает состояние после раунда round_index. False, если этот раунд уже сыгран
+        другим запросом (двойная отправка формы) или игра закончилась'''
+        return self.store.replace(key, state, round_index)
+
+    def finish(self, key):
+        if key:
+            self.store.delete(key)
@@ -0,0 +1,125 @@
+import atexit
+import logging
+import queue
+import threading
+
+import sqlalchemy
+
+from . import db_session
+from .games import Games
+from .rounds import Rounds
+from .users import User
+
+logger = logging.getLogger(__name__)
+
+
+def save_games(db_sess, games):
+    '''Добавляет в сессию законченные игры: строку игры, раунды и изменения статистики пользователя.
+    games - список (id пользователя, раунды, счет за игру),
+    раунд - (широта цели, долгота цели, широта ответа, долгота ответа, очки, id точки).
+    В играх, начатых до появления id точки, его в раунде нет.
+    Коммит делает вызывающий код, поэтому все игры попадают в одну транзакцию.'''
+    for user_id, rounds, gamescore in games:
+        game = Games(rating=gamescore, user_id=user_id)
+        db_sess.add(game)
+        # flush нужен только чтобы получить id игры, коммита здесь нет
+        db_sess.flush()
+        db_sess.add_all([Rounds(game_id=game.id, round_index=i, start_lat=start_lat, start_lon=start_lon,
+                                input_lat=input_lat, input_lon=input_lon, rating=score,
+                                point_id=point[0] if point else None)
+                         for i, (start_lat, start_lon, input_lat, input_lon, score, *point) in enumerate(rounds)])
+        db_sess.query(User).filter(User.id == user_id).update({
+            User.matches_number: sqlalchemy.func.coalesce(User.matches_number, 0) + 1,
+            User.rating: sqlalchemy.case((sqlalchemy.func.coalesce(User.rating, 0) < gamescore, gamescore),
+                                         else_=User.rating)}, synchronize_session=False)
+
+
+class GameWriter:
+    '''Запись законченных игр. Без фонового режима игра пишется сразу одной транзакцией.
+    В фоновом режиме игры складываются в очередь, и отдельный поток записывает их пачками:
+    одна транзакция на batch_size игр или на все, что накопилось за flush_interval секунд.
+    После записи вызывается on_saved с множеством id пользователей, у которых изменилась статистика.'''
+
+    def __init__(self, on_saved=None, background=False, batch_size=50, flush_interval=0.5, max_queue=10000):
+        self.on_saved = on_saved
+        self.background = background
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def save(self, user_id, rounds, gamescore):
+        game = (user_id, [tuple(r) for r in rounds], gamescore)
+        if not self.background:
+            self._write([game])
+            self._saved([game])
+            return
+        self._start()
+        # если очередь переполнена, запрос ждет, пока поток запишет очередную пачку
+        self._queue.put(game)
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        '''Дописывает очередь и останавливает поток'''
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            game = self._queue.get()
+            if game is None:
+                return
+            batch = [game]
+            stop = False
+            try:
+                while len(batch) < self.batch_size:
+                    game = self._queue.get(timeout=self.flush_interval)
+                    if game is None:
+                        stop = True
+                        break
+                    batch.append(game)
+            except queue.Empty:
+                pass
+            try:
+                self._write(batch)
+            except Exception:
+                # одна плохая игра не должна потерять всю пачку: пишем по одной
+                logger.exception('Не удалось записать пачку игр, запись по одной')
+                saved = []
+                for game in batch:
+                    try:
+                        self._write([game])
+                        saved.append(game)
+                    except Exception:
+                        logger.exception('Не удалось записать игру пользователя %s', game[0])
+                batch = saved
+            try:
+                self._saved(batch)
+            except Exception:
+                logger.exception('Ошибка при обработке записанных игр')
+            if stop:
+                return
+
+    def _write(self, games):
+        db_sess = db_session.create_session()
+        try:
+            save_games(db_sess, games)
+            db_sess.commit()
+        except Exception:
+            db_sess.rollback()
+            raise
+        finally:
+            db_sess.close()
+
+    def _saved(self, games):
+        if self.on_saved and games:
+            self.on_saved({game[0] for game in games})
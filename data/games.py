@@ -9,24 +9,17 @@ class Games(SqlAlchemyBase):
     __tablename__ = 'games'
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
-    round1 = sqlalchemy.Column(sqlalchemy.Integer,
-                                sqlalchemy.ForeignKey("rounds.id"))
-    round2 = sqlalchemy.Column(sqlalchemy.Integer,
-                               sqlalchemy.ForeignKey("rounds.id"))
-    round3 = sqlalchemy.Column(sqlalchemy.Integer,
-                               sqlalchemy.ForeignKey("rounds.id"))
-    round4 = sqlalchemy.Column(sqlalchemy.Integer,
-                               sqlalchemy.ForeignKey("rounds.id"))
-    round5 = sqlalchemy.Column(sqlalchemy.Integer,
-                               sqlalchemy.ForeignKey("rounds.id"))
     rating = sqlalchemy.Column(sqlalchemy.Integer, default=0)
     user_id = sqlalchemy.Column(sqlalchemy.Integer,
-                                sqlalchemy.ForeignKey("user.id"))
+                                sqlalchemy.ForeignKey("user.id"), index=True)
     modifed_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
 
+    # история игр пользователя читается от новых к старым (см. data/history.py),
+    # таблицы лидеров за день, неделю и месяц строятся по играм за период (см. scheduled/update_windows.py)
+    __table_args__ = (sqlalchemy.Index('ix_games_user_id_modifed_date', 'user_id', 'modifed_date', 'id'),
+                      sqlalchemy.Index('ix_games_modifed_date', 'modifed_date'))
+
     user = orm.relation('User')
-    roundsrel1 = orm.relation('Rounds', foreign_keys=[round1])
-    roundsrel2 = orm.relation('Rounds', foreign_keys=[round2])
-    roundsrel3 = orm.relation('Rounds', foreign_keys=[round3])
-    roundsrel4 = orm.relation('Rounds', foreign_keys=[round4])
-    roundsrel5 = orm.relation('Rounds', foreign_keys=[round5])
+    # раунды игры хранятся в rounds с game_id и номером раунда.
+    # Раньше у игры было пять столбцов round1..round5, они переносятся командой python -m scheduled.migrate_rounds
+    rounds = orm.relation('Rounds', order_by='Rounds.round_index')
@@ -0,0 +1,27 @@
+from sqlalchemy import or_, and_
+
+from .games import Games
+from .rounds import Rounds
+
+
+def load_games(db_sess, user_id, limit=20, before_id=None):
+    '''Последние игры пользователя вместе с раундами за два запроса.
+    Игры идут от новых к старым по (modifed_date, id). Для следующей страницы передается before_id -
+    id последней показанной игры (keyset-пагинация, без OFFSET).
+    Возвращает список пар (игра, список раундов) и признак того, что есть более старые игры.'''
+    query = db_sess.query(Games).filter(Games.user_id == user_id)
+    if before_id is not None:
+        before_date = db_sess.query(Games.modifed_date).filter(Games.id == before_id).scalar_subquery()
+        query = query.filter(or_(Games.modifed_date < before_date,
+                                 and_(Games.modifed_date == before_date, Games.id < before_id)))
+    # берется на одну игру больше, чтобы узнать, есть ли следующая страница
+    games = query.order_by(Games.modifed_date.desc(), Games.id.desc()).limit(limit + 1).all()
+    has_more = len(games) > limit
+    games = games[:limit]
+
+    rounds = {game.id: [] for game in games}
+    if rounds:
+        for round in db_sess.query(Rounds).filter(Rounds.game_id.in_(rounds)).order_by(Rounds.game_id,
+                                                                                          Rounds.round_index):
+            rounds[round.game_id].append(round)
+    return [(game, rounds[game.id]) for game in games], has_more
@@ -0,0 +1,429 @@
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+
+class StringColumn:
+    '''Столбец строк, упакованных в один bytearray (utf-8) со смещениями и длинами по номеру строки.
+    При изменении строка дописывается в конец, старые байты становятся мусором
+    и убираются при сжатии, когда мусора становится больше, чем живых данных.'''
+
+    def __init__(self):
+        self.blob = bytearray()
+        self.offsets = array('q')
+        self.lengths = array('l')  # -1 - значение None
+        self._garbage = 0
+
+    def resize(self, size):
+        if size > len(self.offsets):
+            grow = size - len(self.offsets)
+            self.offsets.frombytes(bytes(grow * self.offsets.itemsize))
+            self.lengths.extend([-1] * grow)
+
+    def get(self, i):
+        length = self.lengths[i]
+        if length < 0:
+            return None
+        offset = self.offsets[i]
+        return self.blob[offset:offset + length].decode()
+
+    def set(self, i, value):
+        if self.lengths[i] > 0:
+            self._garbage += self.lengths[i]
+        if value is None:
+            self.lengths[i] = -1
+        else:
+            data = value.encode()
+            self.offsets[i] = len(self.blob)
+            self.lengths[i] = len(data)
+            self.blob += data
+        if self._garbage > 1 << 20 and self._garbage > len(self.blob) - self._garbage:
+            self.compact()
+
+    def compact(self):
+        blob = bytearray()
+        for i, length in enumerate(self.lengths):
+            if length > 0:
+                offset = self.offsets[i]
+                self.offsets[i] = len(blob)
+                blob += self.blob[offset:offset + length]
+        self.blob = blob
+        self._garbage = 0
+
+    def nbytes(self):
+        return len(self.blob) + len(self.offsets) * self.offsets.itemsize + len(self.lengths) * self.lengths.itemsize
+
+
+class Columns:
+    '''Данные пользователей по столбцам. Номер строки равен id пользователя
+    (id в базе идут подряд, поэтому дыр после удалений немного).'''
+
+    def __init__(self):
+        self.present = bytearray()
+        self.ratings = array('q')
+        self.matches = array('q')
+        self.nicknames = StringColumn()
+        self.logins = StringColumn()
+        self.count = 0
+
+    def _ensure(self, user_id):
+        if user_id < len(self.present):
+            return
+        size = max(user_id + 1, 2 * len(self.present))
+        grow = size - len(self.present)
+        self.present.extend(bytes(grow))
+        self.ratings.frombytes(bytes(grow * self.ratings.itemsize))
+        self.matches.frombytes(bytes(grow * self.matches.itemsize))
+        self.nicknames.resize(size)
+        self.logins.resize(size)
+
+    def __contains__(self, user_id):
+        return 0 <= user_id < len(self.present) and self.present[user_id]
+
+    def set(self, user_id, nickname, login, rating, matches_number):
+        self._ensure(user_id)
+        if not self.present[user_id]:
+            self.present[user_id] = 1
+            self.count += 1
+        self.ratings[user_id] = rating
+        self.matches[user_id] = matches_number
+        self.nicknames.set(user_id, nickname)
+        self.logins.set(user_id, login)
+
+    def remove(self, user_id):
+        if user_id in self:
+            self.present[user_id] = 0
+            self.count -= 1
+            self.nicknames.set(user_id, None)
+            self.logins.set(user_id, None)
+
+    def key(self, user_id):
+        return -self.ratings[user_id], self.matches[user_id], user_id
+
+    def user(self, user_id):
+        '''(ник, рейтинг, количество матчей, логин)'''
+        return (self.nicknames.get(user_id), self.ratings[user_id], self.matches[user_id],
+                self.logins.get(user_id))
+
+    def row(self, user_id):
+        '''(ник, рейтинг, количество матчей, логин, id) - в таком виде строки отдаются шаблонам'''
+        return self.user(user_id) + (user_id,)
+
+    def ids(self):
+        present = self.present
+        return (user_id for user_id in range(len(present)) if present[user_id])
+
+    def items(self):
+        return ((user_id, self.user(user_id)) for user_id in self.ids())
+
+    def nbytes(self):
+        return {'present': len(self.present),
+                'ratings': len(self.ratings) * self.ratings.itemsize,
+                'matches': len(self.matches) * self.matches.itemsize,
+                'nicknames': self.nicknames.nbytes(),
+                'logins': self.logins.nbytes()}
+
+
+class SparseColumns:
+    '''Те же данные, что в Columns, но в словаре id -> (ник, рейтинг, количество матчей, логин).
+    Для таблиц, где есть только малая часть пользователей (рейтинги за период): память и обход
+    зависят от числа строк, а не от наибольшего id.'''
+
+    def __init__(self):
+        self._users = {}
+
+    @property
+    def count(self):
+        return len(self._users)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def set(self, user_id, nickname, login, rating, matches_number):
+        self._users[user_id] = (nickname, rating, matches_number, login)
+
+    def remove(self, user_id):
+        self._users.pop(user_id, None)
+
+    def key(self, user_id):
+        _, rating, matches_number, _ = self._users[user_id]
+        return -rating, matches_number, user_id
+
+    def user(self, user_id):
+        return self._users[user_id]
+
+    def row(self, user_id):
+        return self._users[user_id] + (user_id,)
+
+    def ids(self):
+        return iter(self._users)
+
+    def items(self):
+        return iter(self._users.items())
+
+    def nbytes(self):
+        return {'users': sys.getsizeof(self._users) + sum(
+            sys.getsizeof(user) + sum(sys.getsizeof(value) for value in user) for user in self._users.values())}
+
+
+class Leaderboard:
+    '''Таблица лидеров, которая обновляется по одному пользователю.
+    Порядок такой же, как был у полной сортировки: (-рейтинг, количество матчей), при равенстве - по id.
+    Данные пользователей лежат по столбцам в типизированных массивах (см. Columns), порядок хранится
+    как id в отсортированных корзинах примерно одинакового размера. Поверх размеров корзин
+    построено дерево Фенвика, поэтому вставка, удаление и поиск позиции работают за O(log n).
+    Хранилище строк задается columns_class: Columns (по умолчанию) или SparseColumns.'''
+
+    # размер корзины. При превышении удвоенного размера корзина делится пополам
+    load = 512
+
+    def __init__(self, columns_class=Columns):
+        self._lock = threading.RLock()
+        self._columns_class = columns_class
+        self._columns = columns_class()
+        self._lists = []  # корзины с id в порядке рейтинга
+        self._maxes = []  # ключ (-рейтинг, количество матчей, id) последнего пользователя каждой корзины
+        self._tree = []  # дерево Фенвика по длинам корзин
+        self._pending = None  # изменения, пришедшие во время полной перестройки
+        self._listeners = []  # индексы, которые обновляются вместе с таблицей (см. subscribe)
+        # версия - время изменения в микросекундах, а не счетчик с нуля: по ней строятся ETag страниц,
+        # и она не должна повторяться после перезапуска или совпадать в разных процессах-обработчиках
+        self.version = time.time_ns() // 1000
+        self.updated = time.time()
+
+    def subscribe(self, listener):
+        '''Подписывает индекс на изменения таблицы. У него должны быть методы
+        build(items) - построить новое состояние индекса, swap(state) - подменить им текущее,
+        update_user(user_id, user) и remove_user(user_id),
+        где items - пары (id, user), а user - кортеж (ник, рейтинг, количество матчей, логин).'''
+        with self._lock:
+            self._listeners.append(listener)
+            listener.swap(listener.build(self._columns.items()))
+
+    def __len__(self):
+        return self._columns.count
+
+    def __contains__(self, user_id):
+        return user_id in self._columns
+
+    def __iter__(self):
+        '''Все пользователи в порядке рейтинга. Список копируется, чтобы не держать блокировку.'''
+        with self._lock:
+            row = self._columns.row
+            rows = [row(user_id) for lst in self._lists for user_id in lst]
+        return iter(rows)
+
+    def page_count(self, size=20):
+        return len(self) // size + bool(len(self) % size)
+
+    def page(self, page_number, size=20):
+        '''Срез таблицы для страницы рейтинга: кортежи (ник, рейтинг, матчи, логин, id)'''
+        return self.slice(size * page_number, size * (page_number + 1))
+
+    def slice(self, start, stop):
+        with self._lock:
+            start = max(start, 0)
+            stop = min(stop, len(self))
+            if start >= stop:
+                return []
+            result = []
+            row = self._columns.row
+            i, offset = self._locate(start)
+            count = stop - start
+            while count > 0:
+                chunk = self._lists[i][offset:offset + count]
+                result.extend(row(user_id) for user_id in chunk)
+                count -= len(chunk)
+                i += 1
+                offset = 0
+            return result
+
+    def sort_ids(self, user_ids):
+        '''Упорядочивает id пользователей так же, как в таблице. Неизвестные id отбрасываются'''
+        with self._lock:
+            columns = self._columns
+            keys = [columns.key(user_id) for user_id in user_ids if user_id in columns]
+        keys.sort()
+        return [key[2] for key in keys]
+
+    def get(self, user_id):
+        with self._lock:
+            if user_id not in self._columns:
+                return None
+            return self._columns.row(user_id)
+
+    def rank(self, user_id):
+        '''Место пользователя в таблице (с нуля) или None за O(log n): корзина ищется по ключам _maxes,
+        место в ней - бинарным поиском, а число пользователей в корзинах перед ней дает дерево Фенвика'''
+        with self._lock:
+            return self._rank(user_id)
+
+    def around(self, user_id, k=5):
+        '''Место пользователя и строки таблицы вокруг него: до k выше и до k ниже. (None, []), если его нет'''
+        with self._lock:
+            rank = self._rank(user_id)
+            if rank is None:
+                return None, []
+            return rank, self.slice(rank - k, rank + k + 1)
+
+    def update_user(self, user_id, nickname, login, rating, matches_number):
+        '''Добавляет пользователя или меняет его данные'''
+        rating = rating or 0
+        matches_number = matches_number or 0
+        with self._lock:
+            if self._pending is not None:
+                self._pending[user_id] = (nickname, login, rating, matches_number)
+            columns = self._columns
+            if user_id in columns:
+                self._remove(columns.key(user_id))
+            columns.set(user_id, nickname, login, rating, matches_number)
+            self._insert(user_id)
+            for listener in self._listeners:
+                listener.update_user(user_id, columns.user(user_id))
+            self._touch()
+
+    def remove_user(self, user_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending[user_id] = None
+            if user_id not in self._columns:
+                return
+            self._remove(self._columns.key(user_id))
+            self._columns.remove(user_id)
+            for listener in self._listeners:
+                listener.remove_user(user_id)
+            self._touch()
+
+    def rebuild(self, rows):
+        '''Полная перестройка из строк (id, ник, логин, рейтинг, количество матчей).
+        Строки читаются и индексы подписчиков строятся без блокировки. Изменения, которые пришли
+        за это время, накладываются сверху, чтобы старые данные из базы не затерли их.'''
+        with self._lock:
+            self._pending = {}
+            listeners = list(self._listeners)
+        try:
+            columns = self._columns_class()
+            for user_id, nickname, login, rating, matches_number in rows:
+                columns.set(user_id, nickname, login, rating or 0, matches_number or 0)
+            ids = sorted(columns.ids(), key=columns.key)
+            # новые столбцы видны только этому потоку, поэтому индексы по ним строятся без блокировок
+            states = [listener.build(columns.items()) for listener in listeners]
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._columns = columns
+            self._lists = [array('q', ids[i:i + self.load]) for i in range(0, len(ids), self.load)]
+            self._maxes = [columns.key(lst[-1]) for lst in self._lists]
+            self._build_tree()
+            # старые индексы возвращаются в states и освобождаются после блокировки
+            states = [listener.swap(state) for listener, state in zip(listeners, states)]
+            for listener in self._listeners[len(listeners):]:
+                # подписался во время перестройки, построен по старым столбцам
+                listener.swap(listener.build(columns.items()))
+            for user_id, row in pending.items():
+                if row is None:
+                    self.remove_user(user_id)
+                else:
+                    self.update_user(user_id, *row)
+            self._touch()
+
+    def export(self):
+        '''Согласованная копия для снимка таблицы: (версия, время изменения, строки в порядке рейтинга)'''
+        with self._lock:
+            return self.version, self.updated, list(self)
+
+    def memory_usage(self):
+        '''Занимаемая память в байтах по столбцам и для порядка (корзины с id)'''
+        with self._lock:
+            usage = self._columns.nbytes()
+            usage['order'] = sum(len(lst) * lst.itemsize for lst in self._lists)
+        return usage
+
+    def _rank(self, user_id):
+        columns = self._columns
+        if user_id not in columns:
+            return None
+        key = columns.key(user_id)
+        i = bisect_left(self._maxes, key)
+        return self._tree_prefix(i) + bisect_left(self._lists[i], key, key=columns.key)
+
+    def _touch(self):
+        self.version = max(self.version + 1, time.time_ns() // 1000)
+        self.updated = time.time()
+
+    def _insert(self, user_id):
+        columns = self._columns
+        key = columns.key(user_id)
+        if not self._lists:
+            self._lists.append(array('q', [user_id]))
+            self._maxes.append(key)
+            self._build_tree()
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._lists[i].append(user_id)
+            self._maxes[i] = key
+        else:
+            insort(self._lists[i], user_id, key=columns.key)
+        self._tree_add(i, 1)
+        if len(self._lists[i]) > 2 * self.load:
+            lst = self._lists[i]
+            self._lists[i:i + 1] = [lst[:self.load], lst[self.load:]]
+            self._maxes[i:i + 1] = [columns.key(lst[self.load - 1]), columns.key(lst[-1])]
+            self._build_tree()
+
+    def _remove(self, key):
+        '''Удаляет пользователя по ключу. Вызывается до изменения его столбцов'''
+        columns = self._columns
+        i = bisect_left(self._maxes, key)
+        lst = self._lists[i]
+        del lst[bisect_left(lst, key, key=columns.key)]
+        if lst:
+            self._maxes[i] = columns.key(lst[-1])
+            self._tree_add(i, -1)
+        else:
+            del self._lists[i]
+            del self._maxes[i]
+            self._build_tree()
+
+    def _build_tree(self):
+        tree = [len(lst) for lst in self._lists]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, i, delta):
+        tree = self._tree
+        while i < len(tree):
+            tree[i] += delta
+            i |= i + 1
+
+    def _tree_prefix(self, i):
+        '''Количество ключей в корзинах до i (не включая i)'''
+        total = 0
+        tree = self._tree
+        while i > 0:
+            total += tree[i - 1]
+            i &= i - 1
+        return total
+
+    def _locate(self, position):
+        '''Номер корзины и смещение в ней для позиции в общем порядке'''
+        tree = self._tree
+        i = 0
+        step = 1 << (len(tree).bit_length() - 1) if tree else 0
+        while step:
+            j = i + step
+            if j <= len(tree) and tree[j - 1] <= position:
+                position -= tree[j - 1]
+                i = j
+            step >>= 1
+        return i, position
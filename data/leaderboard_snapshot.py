@@ -0,0 +1,187 @@
+'''Снимок таблицы лидеров в бинарном файле для нескольких процессов-обработчиков.
+
+Таблицу строит один процесс (scheduled/publish_top.py) и публикует ее в файл, а обработчики
+отображают файл в память (mmap) только для чтения. Страницы ОС с данными общие для всех процессов,
+и при чтении строки копируются только те 20 пользователей, которые нужны странице.
+
+Формат файла (все числа little-endian, целые - 8 байт):
+    заголовок: MAGIC, версия, время изменения (double), количество пользователей n
+    id пользователей в порядке рейтинга (n), рейтинги (n), количества матчей (n),
+    id по возрастанию (n) и позиции этих id в рейтинге (n) - для поиска пользователя по id,
+    смещения ников (n + 1) и логинов (n + 1) в их блоках, блок ников, блок логинов (utf-8).
+Файл пишется рядом во временный и переименовывается через os.replace, поэтому обработчик
+всегда видит либо старый, либо новый снимок целиком.
+'''
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+MAGIC = b'PANOTOP1'
+HEADER = struct.Struct('<8sqdq')
+
+
+def write_snapshot(path, version, updated, rows):
+    '''Пишет снимок из строк (ник, рейтинг, матчи, логин, id) в порядке рейтинга.
+    None в нике и логине записывается пустой строкой'''
+    if sys.byteorder != 'little':
+        raise RuntimeError('Снимок таблицы лидеров пишется только на little-endian платформах')
+    ids, ratings, matches = array('q'), array('q'), array('q')
+    nick_offsets, login_offsets = array('q', [0]), array('q', [0])
+    nicknames, logins = bytearray(), bytearray()
+    for nickname, rating, matches_number, login, user_id in rows:
+        ids.append(user_id)
+        ratings.append(rating)
+        matches.append(matches_number)
+        nicknames += (nickname or '').encode()
+        nick_offsets.append(len(nicknames))
+        logins += (login or '').encode()
+        login_offsets.append(len(logins))
+    by_id = sorted(range(len(ids)), key=ids.__getitem__)
+    sorted_ids = array('q', (ids[i] for i in by_id))
+    positions = array('q', by_id)
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, version, updated, len(ids)))
+        for column in (ids, ratings, matches, sorted_ids, positions, nick_offsets, login_offsets):
+            column.tofile(file)
+        file.write(nicknames)
+        file.write(logins)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+class _Snapshot:
+    '''Один открытый снимок. Столбцы - memoryview поверх mmap, данные не копируются'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self.file_id = (stat.st_ino, stat.st_mtime_ns)
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, self.version, self.updated, n = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError(f'{path} не является снимком таблицы лидеров')
+        self.count = n
+        offset = HEADER.size
+
+        def column(size):
+            nonlocal offset
+            result = view[offset:offset + size * 8].cast('q')
+            offset += size * 8
+            return result
+
+        self.ids = column(n)
+        self.ratings = column(n)
+        self.matches = column(n)
+        self.sorted_ids = column(n)
+        self.positions = column(n)
+        self.nick_offsets = column(n + 1)
+        self.login_offsets = column(n + 1)
+        self.nicknames = view[offset:offset + self.nick_offsets[n]]
+        offset += self.nick_offsets[n]
+        self.logins = view[offset:offset + self.login_offsets[n]]
+
+    def position(self, user_id):
+        '''Место пользователя в рейтинге (с нуля) или None'''
+        i = bisect_left(self.sorted_ids, user_id)
+        if i < self.count and self.sorted_ids[i] == user_id:
+            return self.positions[i]
+        return None
+
+    def row(self, i):
+        '''(ник, рейтинг, количество матчей, логин, id) пользователя на месте i'''
+        return (self._string(self.nicknames, self.nick_offsets, i), self.ratings[i], self.matches[i],
+                self._string(self.logins, self.login_offsets, i), self.ids[i])
+
+    @staticmethod
+    def _string(blob, offsets, i):
+        return bytes(blob[offsets[i]:offsets[i + 1]]).decode()
+
+
+class SnapshotLeaderboard:
+    '''Таблица лидеров только для чтения поверх снимка. Методы чтения такие же, как у Leaderboard.
+    Новый снимок подхватывается в refresh(): он проверяет файл не чаще раза в check_interval секунд.
+    Старый снимок остается открытым, пока его используют запросы, и закрывается сборщиком мусора.'''
+
+    def __init__(self, path, check_interval=0.5):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+        self._snapshot = _Snapshot(path)
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            if (stat.st_ino, stat.st_mtime_ns) != self._snapshot.file_id:
+                self._snapshot = _Snapshot(self.path)
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    @property
+    def updated(self):
+        return self._snapshot.updated
+
+    def __len__(self):
+        return self._snapshot.count
+
+    def __contains__(self, user_id):
+        return self._snapshot.position(user_id) is not None
+
+    def __iter__(self):
+        snapshot = self._snapshot
+        return (snapshot.row(i) for i in range(snapshot.count))
+
+    def items(self):
+        '''Пары (id, (ник, рейтинг, количество матчей, логин)), как у Columns.items'''
+        return ((row[4], row[:4]) for row in self)
+
+    def page_count(self, size=20):
+        return len(self) // size + bool(len(self) % size)
+
+    def page(self, page_number, size=20):
+        return self.slice(size * page_number, size * (page_number + 1))
+
+    def slice(self, start, stop):
+        snapshot = self._snapshot
+        return [snapshot.row(i) for i in range(max(start, 0), min(stop, snapshot.count))]
+
+    def sort_ids(self, user_ids):
+        snapshot = self._snapshot
+        positions = [snapshot.position(user_id) for user_id in user_ids]
+        return [snapshot.ids[i] for i in sorted(i for i in positions if i is not None)]
+
+    def rank(self, user_id):
+        '''Место пользователя (с нуля) или None, бинарный поиск по id'''
+        return self._snapshot.position(user_id)
+
+    def around(self, user_id, k=5):
+        snapshot = self._snapshot
+        rank = snapshot.position(user_id)
+        if rank is None:
+            return None, []
+        return rank, [snapshot.row(i) for i in range(max(rank - k, 0), min(rank + k + 1, snapshot.count))]
+
+    def get(self, user_id):
+        snapshot = self._snapshot
+        i = snapshot.position(user_id)
+        return None if i is None else snapshot.row(i)
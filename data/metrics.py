@@ -0,0 +1,220 @@
+import heapq
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import sqlalchemy
+from flask import g, has_request_context, request
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096)
+
+
+class Histogram:
+    '''Гистограмма с фиксированными границами корзин, как в формате Prometheus'''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - больше всех границ
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        '''Оценка квантиля сверху: граница корзины, в которую он попал'''
+        if not self.count:
+            return 0
+        rank = q * self.count
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+class Metrics:
+    '''Метрики приложения: гистограммы по имени метрики и маршруту'''
+
+    descriptions = {
+        'request_seconds': ('Время обработки запроса', TIME_BUCKETS),
+        'sql_statements': ('Количество SQL-запросов за запрос', COUNT_BUCKETS),
+        'sql_seconds': ('Время SQL-запросов за запрос', TIME_BUCKETS),
+        'session_cookie_bytes': ('Размер cookie сессии', SIZE_BUCKETS),
+        'leaderboard_refresh_seconds': ('Время полной перестройки таблицы лидеров', TIME_BUCKETS),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (метрика, маршрут) -> Histogram
+
+    def observe(self, name, value, route=''):
+        with self._lock:
+            histogram = self._histograms.get((name, route))
+            if histogram is None:
+                histogram = self._histograms[(name, route)] = Histogram(self.descriptions[name][1])
+            histogram.observe(value)
+
+    def table(self):
+        '''Строки для страницы метрик: (метрика, маршрут, количество, среднее, p50, p95, p99)'''
+        with self._lock:
+            items = sorted(self._histograms.items())
+            return [(name, route, h.count, h.sum / h.count if h.count else 0,
+                     h.quantile(0.5), h.quantile(0.95), h.quantile(0.99)) for (name, route), h in items]
+
+    def render_text(self):
+        '''Выгрузка в текстовом формате Prometheus'''
+        lines = []
+        with self._lock:
+            items = sorted(self._histograms.items())
+            described = set()
+            for (name, route), h in items:
+                metric = f'panorama_{name}'
+                if name not in described:
+                    described.add(name)
+                    lines.append(f'# HELP {metric} {self.descriptions[name][0]}')
+                    lines.append(f'# TYPE {metric} histogram')
+                labels = f'route="{route}",' if route else ''
+                total = 0
+                for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                    total += count
+                    lines.append(f'{metric}_bucket{{{labels}le="{bound}"}} {total}')
+                labels = f'{{route="{route}"}}' if route else ''
+                lines.append(f'{metric}_sum{labels} {h.sum}')
+                lines.append(f'{metric}_count{labels} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class SamplingProfiler:
+    '''Семплирующий профилировщик: фоновый поток раз в interval секунд снимает стеки
+    потоков, которые сейчас обрабатывают запросы. Стеки самых медленных запросов (keep штук)
+    сохраняются в папку в свернутом формате "функция;функция;функция количество",
+    из которого строятся flame graph (например, flamegraph.pl или speedscope).'''
+
+    def __init__(self, folder='profiles', interval=0.005, keep=20):
+        self.folder = folder
+        self.interval = interval
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._active = {}  # id потока -> Counter стеков
+        self._slowest = []  # куча (время, файл)
+        self._thread = None
+
+    def start_request(self):
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def end_request(self, route, elapsed):
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), None)
+            if not stacks or (len(self._slowest) >= self.keep and elapsed <= self._slowest[0][0]):
+                return
+            os.makedirs(self.folder, exist_ok=True)
+            route = re.sub(r'[^\w-]+', '_', route).strip('_') or 'index'
+            path = os.path.join(self.folder, f'{time.strftime("%Y%m%d-%H%M%S")}-{route}-{int(elapsed * 1000)}ms.folded')
+            with open(path, 'w') as file:
+                for stack, count in stacks.items():
+                    file.write(f'{stack} {count}\n')
+            heapq.heappush(self._slowest, (elapsed, path))
+            if len(self._slowest) > self.keep:
+                _, removed = heapq.heappop(self._slowest)
+                if os.path.exists(removed):
+                    os.remove(removed)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[self._fold(frame)] += 1
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+def init_app(app, engines):
+    '''Подключает сбор метрик к приложению и к движкам SQLAlchemy.
+    Если app.config['PROFILE_SLOW_REQUESTS'], включается семплирующий профилировщик.'''
+    profiler = None
+    if app.config.get('PROFILE_SLOW_REQUESTS'):
+        profiler = SamplingProfiler(app.config.get('PROFILE_DIR', 'profiles'),
+                                    keep=app.config.get('PROFILE_KEEP', 20))
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        if has_request_context() and 'metrics_start' in g:
+            g.sql_statements += 1
+            g.sql_seconds += elapsed
+        else:
+            # запросы фоновых потоков (обновление таблицы лидеров, запись игр)
+            metrics.observe('sql_seconds', elapsed, 'background')
+
+    for engine in engines:
+        sqlalchemy.event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        sqlalchemy.event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+        if profiler:
+            profiler.start_request()
+
+    @app.after_request
+    def record_cookie_size(response):
+        cookie_name = app.config.get('SESSION_COOKIE_NAME', 'session')
+        sizes = [len(header) for header in response.headers.getlist('Set-Cookie')
+                 if header.startswith(cookie_name + '=')]
+        if not sizes and cookie_name in request.cookies:
+            sizes = [len(request.cookies[cookie_name])]
+        if sizes:
+            metrics.observe('session_cookie_bytes', sizes[0], _route())
+        return response
+
+    @app.teardown_request
+    def record_request(exception=None):
+        if 'metrics_start' not in g:
+            return
+        elapsed = time.perf_counter() - g.pop('metrics_start')
+        route = _route()
+        metrics.observe('request_seconds', elapsed, route)
+        metrics.observe('sql_statements', g.sql_statements, route)
+        metrics.observe('sql_seconds', g.sql_seconds, route)
+        if profiler:
+            profiler.end_request(route, elapsed)
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'not_found'
@@ -0,0 +1,42 @@
+import threading
+from collections import OrderedDict
+
+
+class PageCache:
+    '''LRU-кэш отрисованных кусков страниц. Ключ должен включать версию данных
+    (например, (номер страницы, версия таблицы лидеров)), тогда записи не нужно сбрасывать:
+    после изменения данных старые ключи больше не запрашиваются и вытесняются сами.'''
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # ключ -> отрисованная строка
+
+    def get(self, key, render):
+        '''Строка из кэша или результат render(), который сохраняется в кэш'''
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = render()
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items),
+                    'hit_ratio': self.hits / total if total else 0.0}
@@ -7,5 +7,7 @@ class PanoramaPoints(SqlAlchemyBase):
     __tablename__ = 'panorama_points'
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
-    y = sqlalchemy.Column(sqlalchemy.Integer)
-    x = sqlalchemy.Column(sqlalchemy.Integer)
+    # широта и долгота. Раньше столбцы были объявлены как Integer, но SQLite и тогда хранил
+    # дробные значения как REAL, поэтому старые базы миграции не требуют
+    y = sqlalchemy.Column(sqlalchemy.Float)
+    x = sqlalchemy.Column(sqlalchemy.Float)
@@ -0,0 +1,114 @@
+'''Хэширование паролей в пуле процессов и ограничение попыток входа.
+
+Хэш пароля специально считается долго (десятки и сотни миллисекунд процессора). Если считать его
+в потоке запроса, при наплыве входов и регистраций эти потоки занимают процессор и GIL,
+и игра на том же обработчике начинает тормозить. PasswordHasher отдает хэширование пулу процессов:
+поток запроса только ждет результат. Одновременно в работе не больше max_pending хэшей,
+остальные запросы ждут place_timeout секунд и получают PasswordHasherBusy.
+
+Параметры хэша задаются строкой method, как в werkzeug.security.generate_password_hash
+(например, "scrypt" или "pbkdf2:sha256:600000"). Если параметры поменялись, старый хэш пользователя
+заменяется новым при следующем успешном входе (needs_rehash).
+'''
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=2, max_pending=None, place_timeout=5):
+        self.method = method
+        # полное название метода вместе с параметрами по умолчанию, как оно записывается в начало хэша
+        self.method_prefix = generate_password_hash('', method).split('$', 1)[0]
+        self.workers = workers
+        self.place_timeout = place_timeout
+        self._slots = threading.BoundedSemaphore(max_pending or 4 * max(workers, 1))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # spawn, а не fork: процесс приложения многопоточный, fork копирует чужие блокировки
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _run(self, function, *args):
+        '''Выполняет function в пуле процессов. Если workers=0, то прямо в этом потоке'''
+        if not self.workers:
+            return function(*args)
+        if not self._slots.acquire(timeout=self.place_timeout):
+            raise PasswordHasherBusy()
+        try:
+            return self._get_pool().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, hashed_password, password):
+        if not hashed_password:
+            return False
+        return self._run(check_password_hash, hashed_password, password)
+
+    def needs_rehash(self, hashed_password):
+        return hashed_password.split('$', 1)[0] != self.method_prefix
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+class LoginLimiter:
+    '''Ограничение неудачных попыток входа: не больше max_attempts за window секунд
+    на один логин и не больше ip_attempts на один адрес. Пока лимит исчерпан,
+    пароль даже не проверяется, поэтому перебор не занимает процессор хэшированием.
+    Считает попытки в памяти процесса, храня не больше maxsize ключей: при нескольких
+    процессах-обработчиках у каждого свой счет, и лимиты в сумме в столько же раз больше.
+    Адрес за обратным прокси - это адрес прокси, если не настроен ProxyFix (TRUSTED_PROXIES в main.py).'''
+
+    def __init__(self, max_attempts=5, ip_attempts=50, window=300, maxsize=100000):
+        self.max_attempts = max_attempts
+        self.ip_attempts = ip_attempts
+        self.window = window
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._failures = OrderedDict()  # ключ -> deque времен неудачных попыток
+
+    def _count(self, key, now):
+        failures = self._failures.get(key)
+        if not failures:
+            return 0
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        return len(failures)
+
+    def allowed(self, login, ip):
+        now = time.monotonic()
+        with self._lock:
+            return (self._count(('login', login), now) < self.max_attempts
+                    and self._count(('ip', ip), now) < self.ip_attempts)
+
+    def failed(self, login, ip):
+        now = time.monotonic()
+        with self._lock:
+            for key in (('login', login), ('ip', ip)):
+                self._failures.setdefault(key, deque()).append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.maxsize:
+                self._failures.popitem(last=False)
+
+    def succeeded(self, login, ip):
+        with self._lock:
+            self._failures.pop(('login', login), None)
@@ -0,0 +1,110 @@
+import math
+import random
+import threading
+from array import array
+
+from .scoring import getdistance
+
+
+class PointPool:
+    '''Точки панорам в памяти для выбора случайной точки без обращения к базе данных.
+    Координаты лежат в типизированных массивах. Точки сгруппированы по регионам - клеткам сетки
+    размером region_size градусов. Сначала выбирается регион (по весам, методом алиасов Уолкера),
+    потом точка внутри него, поэтому выбор работает за O(1) и не зависит от дыр в id.'''
+
+    def __init__(self, region_size=1.0):
+        self._lock = threading.Lock()
+        self.region_size = region_size
+        self.weights = {}  # регион -> вес. Если веса нет, вес региона равен числу точек в нем
+        self.ids = array('i')
+        self.ys = array('d')
+        self.xs = array('d')
+        self._regions = []  # ключи регионов
+        self._starts = array('i')  # точки региона r - это ids[starts[r]:starts[r + 1]]
+        self._prob = array('d')
+        self._alias = array('i')
+        self.dirty = True
+
+    def region(self, y, x):
+        return math.floor(y / self.region_size), math.floor(x / self.region_size)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self, rows):
+        '''Загружает точки из строк (id, y, x)'''
+        points = sorted(((self.region(float(y), float(x)), point_id, float(y), float(x))
+                         for point_id, y, x in rows), key=lambda point: point[0])
+        ids, ys, xs = array('i'), array('d'), array('d')
+        regions, starts = [], array('i')
+        for region, point_id, y, x in points:
+            if not regions or regions[-1] != region:
+                regions.append(region)
+                starts.append(len(ids))
+            ids.append(point_id)
+            ys.append(y)
+            xs.append(x)
+        starts.append(len(ids))
+        with self._lock:
+            self.ids, self.ys, self.xs = ids, ys, xs
+            self._regions, self._starts = regions, starts
+            self._build_alias()
+            self.dirty = False
+
+    def set_weights(self, weights):
+        '''Задает веса регионов: словарь {(клетка по y, клетка по x): вес}'''
+        with self._lock:
+            self.weights = dict(weights)
+            self._build_alias()
+
+    def _build_alias(self):
+        starts = self._starts
+        weights = [self.weights.get(region, starts[r + 1] - starts[r]) for r, region in enumerate(self._regions)]
+        n = len(weights)
+        total = sum(weights)
+        prob, alias = array('d', [0.0] * n), array('i', range(n))
+        if total > 0:
+            scaled = [w * n / total for w in weights]
+            small = [i for i, w in enumerate(scaled) if w < 1]
+            large = [i for i, w in enumerate(scaled) if w >= 1]
+            while small and large:
+                s, g = small.pop(), large.pop()
+                prob[s] = scaled[s]
+                alias[s] = g
+                scaled[g] -= 1 - scaled[s]
+                (small if scaled[g] < 1 else large).append(g)
+            for i in small + large:
+                prob[i] = 1.0
+        self._prob, self._alias = prob, alias
+
+    def sample(self, exclude=(), attempts=20):
+        '''Случайная точка (id, y, x). Точки из exclude (например, уже показанные в этой игре)
+        не выбираются, пока в пуле есть другие. Если точек нет, бросается IndexError.'''
+        with self._lock:
+            ids, ys, xs = self.ids, self.ys, self.xs
+            starts, prob, alias = self._starts, self._prob, self._alias
+        if not ids:
+            raise IndexError('Нет точек панорам')
+        for _ in range(attempts):
+            r = random.randrange(len(prob))
+            if random.random() >= prob[r]:
+                r = alias[r]
+            i = random.randrange(starts[r], starts[r + 1])
+            if ids[i] not in exclude:
+                break
+        return ids[i], ys[i], xs[i]
+
+    def sample_many(self, count, exclude=(), min_distance_km=0, attempts=20):
+        '''count разных точек (id, y, x) сразу, например на все раунды игры.
+        Если задан min_distance_km, случайная точка принимается, только если она не ближе этого расстояния
+        к уже выбранным (их не больше count). Если за attempts попыток такой не нашлось, остается последняя:
+        она хотя бы не повторяется, но в маленьком или плотном пуле может оказаться ближе'''
+        points, used = [], set(exclude)
+        for _ in range(count):
+            for _ in range(attempts):
+                point = self.sample(exclude=used)
+                if all(getdistance(point[1:], other[1:]) >= min_distance_km for other in points):
+                    break
+            used.add(point[0])
+            points.append(point)
+        return points
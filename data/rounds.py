@@ -9,7 +9,17 @@ class Rounds(SqlAlchemyBase, UserMixin):
     __tablename__ = 'rounds'
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
-    start_point = sqlalchemy.Column(sqlalchemy.String, nullable=True)
-    user_input_point = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+    game_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("games.id"))
+    # номер раунда в игре, с нуля
+    round_index = sqlalchemy.Column(sqlalchemy.Integer)
+    # точка, выбранная игрой, и точка, выбранная игроком (широта и долгота)
+    start_lat = sqlalchemy.Column(sqlalchemy.Float)
+    start_lon = sqlalchemy.Column(sqlalchemy.Float)
+    input_lat = sqlalchemy.Column(sqlalchemy.Float)
+    input_lon = sqlalchemy.Column(sqlalchemy.Float)
     rating = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+    # id точки панорамы из пула (без внешнего ключа: точки могут удаляться). У старых раундов NULL
+    point_id = sqlalchemy.Column(sqlalchemy.Integer, nullable=True)
     modifed_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
+
+    __table_args__ = (sqlalchemy.Index('ix_rounds_game_id_round_index', 'game_id', 'round_index'),)
@@ -0,0 +1,40 @@
+import math
+import numpy as np
+
+# Параметры подсчета очков за раунд: за каждые DISTANCE_PER_POINT км от цели снимается одно очко
+# из MAX_DISTANCE / DISTANCE_PER_POINT возможных. После изменения формулы старые раунды
+# пересчитываются командой python -m scheduled.rescore
+MAX_DISTANCE = 5000
+DISTANCE_PER_POINT = 5
+
+
+def getdistance(c1, c2):
+    x = (c2[1] - c1[1])
+    y = (c2[0] - c1[0])
+    y *= math.cos(math.radians((c2[1] + c1[1]) / 2))
+    x *= 111
+    y *= 111
+    return math.sqrt(x ** 2 + y ** 2)
+
+
+def round_score(dist):
+    '''Очки за раунд по расстоянию в км'''
+    return max(int((MAX_DISTANCE - dist) / DISTANCE_PER_POINT), 0)
+
+
+def batch_distance(y1, x1, y2, x2):
+    '''То же, что getdistance([y1, x1], [y2, x2]), но для массивов координат.
+    Порядок операций повторяет getdistance, результаты совпадают с точностью до последних знаков float.'''
+    y1, x1, y2, x2 = (np.asarray(a, dtype=np.float64) for a in (y1, x1, y2, x2))
+    x = x2 - x1
+    y = y2 - y1
+    y = y * np.cos(np.radians((x2 + x1) / 2))
+    x = x * 111
+    y = y * 111
+    return np.sqrt(x ** 2 + y ** 2)
+
+
+def batch_score(dist):
+    '''То же, что round_score, для массива расстояний'''
+    score = np.trunc((MAX_DISTANCE - np.asarray(dist, dtype=np.float64)) / DISTANCE_PER_POINT)
+    return np.maximum(score, 0).astype(np.int64)
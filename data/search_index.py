@@ -0,0 +1,185 @@
+import threading
+from bisect import bisect_left, insort
+
+
+class NgramIndex:
+    '''Индекс подстрок по триграммам: триграмма -> множество id.
+    Строки короче трех символов хранятся целиком в отдельном словаре.'''
+
+    n = 3
+
+    def __init__(self):
+        self._grams = {}
+        self._short = {}
+        self._values = {}  # id -> проиндексированная строка
+
+    def _ngrams(self, value):
+        return {value[i:i + self.n] for i in range(len(value) - self.n + 1)}
+
+    def add(self, user_id, value):
+        value = value or ''
+        self._values[user_id] = value
+        if len(value) < self.n:
+            self._short.setdefault(value, set()).add(user_id)
+            return
+        for gram in self._ngrams(value):
+            self._grams.setdefault(gram, set()).add(user_id)
+
+    def remove(self, user_id):
+        value = self._values.pop(user_id, None)
+        if value is None:
+            return
+        if len(value) < self.n:
+            buckets, keys = self._short, (value,)
+        else:
+            buckets, keys = self._grams, self._ngrams(value)
+        for key in keys:
+            ids = buckets[key]
+            ids.discard(user_id)
+            if not ids:
+                del buckets[key]
+
+    def search(self, query):
+        '''Множество id, у которых query входит в строку как подстрока'''
+        if len(query) >= self.n:
+            sets = sorted((self._grams.get(gram, set()) for gram in self._ngrams(query)), key=len)
+            candidates = sets[0].intersection(*sets[1:])
+        else:
+            # короткий запрос: перебираются только ключи индекса, а не пользователи
+            candidates = set()
+            for buckets in (self._grams, self._short):
+                for key, ids in buckets.items():
+                    if query in key:
+                        candidates |= ids
+        # триграммы могут совпасть в разных местах строки, поэтому кандидаты проверяются
+        values = self._values
+        return {user_id for user_id in candidates if query in values[user_id]}
+
+
+class NumericIndex:
+    '''Индекс чисел: значение -> множество id и отсортированный список различных значений'''
+
+    def __init__(self):
+        self._ids = {}
+        self._sorted = []
+        self._values = {}
+
+    def add(self, user_id, value):
+        value = value or 0
+        self._values[user_id] = value
+        ids = self._ids.get(value)
+        if ids is None:
+            ids = self._ids[value] = set()
+            insort(self._sorted, value)
+        ids.add(user_id)
+
+    def remove(self, user_id):
+        value = self._values.pop(user_id, None)
+        if value is None:
+            return
+        ids = self._ids[value]
+        ids.discard(user_id)
+        if not ids:
+            del self._ids[value]
+            del self._sorted[bisect_left(self._sorted, value)]
+
+    def range(self, low, high):
+        '''id со значениями в полуинтервале [low, high)'''
+        result = set()
+        start = bisect_left(self._sorted, low)
+        stop = bisect_left(self._sorted, high)
+        for value in self._sorted[start:stop]:
+            result |= self._ids[value]
+        return result
+
+    def prefix(self, query):
+        '''id, у которых десятичная запись значения начинается с query'''
+        query = str(query).strip()
+        if not query.lstrip('-').isdigit():
+            return set()
+        value = int(query)
+        if value < 0 or query != str(value):
+            return set(self._ids.get(value, ()))
+        result = set()
+        low, high = value, value + 1
+        top = self._sorted[-1] if self._sorted else 0
+        while low <= top:
+            result |= self.range(low, high)
+            if low == 0:
+                # у нуля нет продолжений: 01, 02... не бывает
+                break
+            low, high = low * 10, high * 10
+        return result
+
+
+class UserSearchIndex:
+    '''Индекс для поиска пользователей в админке. Подписывается на таблицу лидеров
+    и обновляется вместе с ней: при полной перестройке и при изменении одного пользователя.
+    При полной перестройке новые индексы строятся без блокировки (build), а подменяются
+    под короткой блокировкой (swap), поэтому поиск и таблица не ждут перестройку.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.login = self.nickname = self.rating = self.matches_number = None
+        self.swap(self.build(()))
+
+    def build(self, items):
+        '''Новые индексы (логин, ник, рейтинг, количество матчей) по парам (id, user)'''
+        indexes = (NgramIndex(), NgramIndex(), NumericIndex(), NumericIndex())
+        for user_id, user in items:
+            self._add(indexes, user_id, user)
+        return indexes
+
+    def swap(self, indexes):
+        '''Подменяет индексы и возвращает старые: их освобождение (миллионы множеств) идет у вызывающего,
+        уже без блокировок'''
+        with self._lock:
+            old = self._indexes()
+            self.login, self.nickname, self.rating, self.matches_number = indexes
+        return old
+
+    @staticmethod
+    def _add(indexes, user_id, user):
+        nickname, rating, matches_number, login = user
+        login_index, nickname_index, rating_index, matches_index = indexes
+        login_index.add(user_id, login)
+        nickname_index.add(user_id, nickname)
+        rating_index.add(user_id, rating)
+        matches_index.add(user_id, matches_number)
+
+    def _indexes(self):
+        return self.login, self.nickname, self.rating, self.matches_number
+
+    def rebuild(self, items):
+        self.swap(self.build(items))
+
+    def update_user(self, user_id, user):
+        with self._lock:
+            indexes = self._indexes()
+            for index in indexes:
+                index.remove(user_id)
+            self._add(indexes, user_id, user)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            for index in self._indexes():
+                index.remove(user_id)
+
+    def search(self, login='', nickname='', rating='', matches_number=''):
+        '''Множество id пользователей, подходящих под все заданные параметры.
+        Логин и ник ищутся как подстроки, рейтинг и количество матчей - по началу числа.
+        Пустые параметры не учитываются. Если не задан ни один параметр, возвращается None.'''
+        with self._lock:
+            sets = []
+            if login:
+                sets.append(self.login.search(login))
+            if nickname:
+                sets.append(self.nickname.search(nickname))
+            if rating not in (None, ''):
+                sets.append(self.rating.prefix(rating))
+            if matches_number not in (None, ''):
+                sets.append(self.matches_number.prefix(matches_number))
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
@@ -0,0 +1,89 @@
+import math
+
+from .scoring import getdistance
+
+# граница, за которой в запрос попадают все точки: больше любого расстояния getdistance
+WORLD_KM = 50000
+
+
+class SpatialIndex:
+    '''Сетка точек по широте и долготе с ячейками cell градусов: поиск точек в радиусе и k ближайших.
+    Расстояние считается как в getdistance: разница долгот умножается на 111 км, а разница широт -
+    еще и на косинус средней долготы. Поэтому по долготе радиус r занимает r / 111 градусов,
+    а по широте - r / (111 * cos), где берется наименьший косинус средней долготы для этого диапазона.
+    Проверяются только ячейки такого прямоугольника, и уже в них точное расстояние.'''
+
+    def __init__(self, cell=0.1):
+        self.cell = cell
+        self._cells = {}  # (клетка по широте, клетка по долготе) -> [(id, широта, долгота)]
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _key(self, lat, lon):
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    def add(self, point_id, lat, lon):
+        self._cells.setdefault(self._key(lat, lon), []).append((point_id, lat, lon))
+        self._count += 1
+
+    def load(self, rows):
+        '''Заменяет точки строками (id, широта, долгота)'''
+        self._cells = {}
+        self._count = 0
+        for point_id, lat, lon in rows:
+            self.add(point_id, float(lat), float(lon))
+
+    def _box(self, lat, lon, radius_km):
+        '''Диапазоны клеток по широте и долготе, в которых могут быть точки на расстоянии до radius_km'''
+        lon_delta = radius_km / 111
+        # средняя долгота лежит в пределах половины диапазона долгот
+        low, high = lon - lon_delta / 2, lon + lon_delta / 2
+        if math.floor((low - 90) / 180) != math.floor((high - 90) / 180):
+            # в диапазоне есть долгота 90 + 180k, где косинус равен нулю
+            lat_delta = 180
+        else:
+            cos = min(abs(math.cos(math.radians(low))), abs(math.cos(math.radians(high))))
+            lat_delta = min(radius_km / (111 * cos), 180) if cos > 0 else 180
+        (lat_low, lon_low), (lat_high, lon_high) = (self._key(lat - lat_delta, lon - lon_delta),
+                                                    self._key(lat + lat_delta, lon + lon_delta))
+        return lat_low, lat_high, lon_low, lon_high
+
+    def _candidates(self, lat, lon, radius_km):
+        lat_low, lat_high, lon_low, lon_high = self._box(lat, lon, radius_km)
+        if (lat_high - lat_low + 1) * (lon_high - lon_low + 1) > len(self._cells):
+            # прямоугольник больше, чем непустых клеток: быстрее пройти по ним
+            for (i, j), points in self._cells.items():
+                if lat_low <= i <= lat_high and lon_low <= j <= lon_high:
+                    yield from points
+            return
+        for i in range(lat_low, lat_high + 1):
+            for j in range(lon_low, lon_high + 1):
+                yield from self._cells.get((i, j), ())
+
+    def radius(self, lat, lon, radius_km):
+        '''Точки на расстоянии до radius_km: список (расстояние, id, широта, долгота) по возрастанию расстояния'''
+        found = []
+        for point_id, point_lat, point_lon in self._candidates(lat, lon, radius_km):
+            dist = getdistance((lat, lon), (point_lat, point_lon))
+            if dist <= radius_km:
+                found.append((dist, point_id, point_lat, point_lon))
+        found.sort()
+        return found
+
+    def has_near(self, lat, lon, radius_km):
+        for point_id, point_lat, point_lon in self._candidates(lat, lon, radius_km):
+            if getdistance((lat, lon), (point_lat, point_lon)) <= radius_km:
+                return True
+        return False
+
+    def nearest(self, lat, lon, k=1, max_km=WORLD_KM):
+        '''k ближайших точек не дальше max_km: список (расстояние, id, широта, долгота).
+        Радиус поиска начинается с размера клетки и удваивается, пока не найдется k точек'''
+        radius_km = min(self.cell * 111, max_km)
+        while True:
+            found = self.radius(lat, lon, radius_km)
+            if len(found) >= k or radius_km >= max_km or radius_km >= WORLD_KM:
+                return found[:k]
+            radius_km = min(radius_km * 2, max_km)
@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class UserCache:
+    '''LRU-кэш пользователей для flask_login с временем жизни записи.
+    Записи сбрасываются явно (invalidate) при изменении пользователя, а ttl ограничивает
+    время, в течение которого могут быть видны изменения, сделанные в обход приложения
+    или в другом процессе-обработчике.'''
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # id -> (время загрузки, пользователь)
+
+    def get(self, user_id, loader):
+        '''Пользователь из кэша или из loader(user_id). Отсутствующие пользователи не кэшируются'''
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is not None and now - item[0] < self.ttl:
+                self._items.move_to_end(user_id)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+        user = loader(user_id)
+        if user is not None:
+            with self._lock:
+                self._items[user_id] = (now, user)
+                self._items.move_to_end(user_id)
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._items.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items),
+                    'hit_ratio': self.hits / total if total else 0.0}
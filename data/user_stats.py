@@ -0,0 +1,19 @@
+import sqlalchemy
+
+from .db_session import SqlAlchemyBase
+
+
+class UserStats(SqlAlchemyBase):
+    '''Итоги игр пользователя, которые перенесены в архив (см. scheduled/compact_history.py).
+    Сами игры и раунды из основной базы удаляются, а здесь остаются суммы по ним'''
+    __tablename__ = 'user_stats'
+
+    user_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("user.id"), primary_key=True)
+    archived_games = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+    archived_rounds = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+    # сумма и лучший результат архивных игр, сумма очков архивных раундов
+    games_rating_sum = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+    best_game_rating = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+    rounds_rating_sum = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+    first_game_date = sqlalchemy.Column(sqlalchemy.DateTime)
+    last_game_date = sqlalchemy.Column(sqlalchemy.DateTime)
@@ -2,7 +2,6 @@ import datetime
 import sqlalchemy
 from flask_login import UserMixin
 
-from werkzeug.security import generate_password_hash, check_password_hash
 from .db_session import SqlAlchemyBase
 
 
@@ -16,10 +15,4 @@ class User(SqlAlchemyBase, UserMixin):
     rating = sqlalchemy.Column(sqlalchemy.Integer, nullable=True, default=0)
     matches_number = sqlalchemy.Column(sqlalchemy.Integer, nullable=True, default=0)
     modifed_date = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now)
-    is_admin = sqlalchemy.Column(sqlalchemy.Boolean, default=False)
-
-    def set_password(self, password):
-        self.hashed_password = generate_password_hash(password)
-
-    def check_password(self, password):
-        return check_password_hash(self.hashed_password, password)
\ No newline at end of file
+    is_admin = sqlalchemy.Column(sqlalchemy.Boolean, default=False)
\ No newline at end of file
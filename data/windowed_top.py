@@ -0,0 +1,74 @@
+import datetime
+import threading
+
+from .leaderboard import Leaderboard, SparseColumns
+
+PERIODS = ('day', 'week', 'month')
+
+
+def period_start(period, now):
+    '''Начало текущего дня, недели (с понедельника) или месяца'''
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'day':
+        return day
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    raise ValueError(f'Неизвестный период {period}')
+
+
+class WindowedLeaderboard:
+    '''Таблица лидеров за текущий день, неделю или месяц. Рейтинг пользователя - лучшая игра за период,
+    количество матчей - игры за период. Агрегаты хранятся только для тех, кто играл в этом периоде,
+    а при смене периода просто сбрасываются (expire), поэтому устаревание ничего не стоит.
+    Порядок и страницы - обычный Leaderboard, но строки в словаре (SparseColumns): за период играет
+    малая часть пользователей, а массивы Columns растут до наибольшего id.'''
+
+    def __init__(self, period, now=None):
+        self.period = period
+        self.start = period_start(period, now or datetime.datetime.now())
+        self.leaderboard = Leaderboard(SparseColumns)
+        self._scores = {}  # id -> (лучшая игра, количество игр)
+        self._lock = threading.Lock()
+
+    def expire(self, now=None):
+        '''Начинает новый период, если текущий закончился'''
+        start = period_start(self.period, now or datetime.datetime.now())
+        with self._lock:
+            if start > self.start:
+                self.start = start
+                self._scores = {}
+                # rebuild, а не новый Leaderboard: версия таблицы должна расти (по ней кэшируются страницы)
+                self.leaderboard.rebuild([])
+
+    def add_game(self, user_id, nickname, login, rating, date):
+        '''Учитывает законченную игру. Игры прошлых периодов пропускаются'''
+        with self._lock:
+            if date < self.start:
+                return
+            best, count = self._scores.get(user_id, (0, 0))
+            best, count = max(best, rating or 0), count + 1
+            self._scores[user_id] = (best, count)
+            self.leaderboard.update_user(user_id, nickname, login, best, count)
+
+    def rebuild(self, start, rows):
+        '''Полная перестройка за период, начинающийся в start,
+        из строк (id, ник, логин, лучшая игра, количество игр)'''
+        with self._lock:
+            rows = list(rows)
+            self.start = start
+            self._scores = {user_id: (best or 0, count) for user_id, _, _, best, count in rows}
+            self.leaderboard.rebuild(rows)
+
+    def update_user(self, user_id, nickname, login):
+        '''Переносит новые ник и логин пользователя, если он играл в этом периоде'''
+        with self._lock:
+            if user_id in self._scores:
+                best, count = self._scores[user_id]
+                self.leaderboard.update_user(user_id, nickname, login, best, count)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            self._scores.pop(user_id, None)
+            self.leaderboard.remove_user(user_id)
@@ -1,40 +1,82 @@
-from flask import Flask, redirect, render_template, request, session
+from flask import Flask, Response, abort, make_response, redirect, render_template, request, session
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 import sqlalchemy
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from data import db_session
+from data import db_session, history
 from data.users import User
-from data.rounds import Rounds
-from data.games import Games
-from data.panorama_points import PanoramaPoints
+from data.user_stats import UserStats
 from data.login_form import LoginForm
 from data.register_form import RegistrationForm
 from data.delete_form import DeleteForm
 from data.search_form import SearchForm
 from data.game_button import ConfirmPlace
+from data.scoring import getdistance, round_score
+from data.game_writer import GameWriter
+from data.game_state import GameStates, MemoryStore, SqliteStore
+from data.passwords import LoginLimiter, PasswordHasher, PasswordHasherBusy
+from data.user_cache import UserCache
+from data.page_cache import PageCache
+from data.metrics import metrics, init_app as init_metrics
+import scheduled.update_top as player_top
+import scheduled.update_points as update_points
+import scheduled.update_windows as update_windows
+import datetime
 import threading
 import random
-import math
+from urllib.parse import urlencode
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'yandexlyceum_secret_key'
+# Если True, законченные игры пишутся в базу фоновым потоком пачками (см. data/game_writer.py)
+app.config['GAME_WRITE_BEHIND'] = False
+# Если True, стеки самых медленных запросов сохраняются в папку PROFILE_DIR (см. data/metrics.py)
+app.config['PROFILE_SLOW_REQUESTS'] = False
+app.config['PROFILE_DIR'] = 'profiles'
+# Точки раундов одной игры выбираются не ближе этого расстояния друг к другу (если в пуле хватает точек)
+app.config['ROUND_SPREAD_KM'] = 100
+# Параметры хэша паролей (как method в werkzeug.security.generate_password_hash) и число процессов,
+# которые его считают (0 - считать в потоке запроса). См. data/passwords.py
+app.config['PASSWORD_HASH_METHOD'] = 'scrypt'
+app.config['PASSWORD_HASH_WORKERS'] = 2
+# Сколько обратных прокси (nginx и т.п.) стоит перед приложением. Если больше нуля, адрес клиента
+# для ограничения попыток входа берется из X-Forwarded-For, который дописывают эти прокси (см. ProxyFix).
+# Без прокси должно быть 0, иначе клиент сам подставит любой адрес
+app.config['TRUSTED_PROXIES'] = 0
+# Время жизни пользователя в кэше, когда процессов-обработчиков несколько (задан снимок таблицы лидеров).
+# Кэш сбрасывается только в том процессе, где пользователя изменили или удалили,
+# остальные процессы видят изменение не позже чем через столько секунд
+app.config['SHARED_USER_CACHE_TTL'] = 5
 login_manager = LoginManager()
 login_manager.init_app(app)
-
-
-def getdistance(c1, c2):
-    x = (c2[1] - c1[1])
-    y = (c2[0] - c1[0])
-    y *= math.cos(math.radians((c2[1] + c1[1]) / 2))
-    x *= 111
-    y *= 111
-    return math.sqrt(x ** 2 + y ** 2)
+# пользователи для flask_login берутся из кэша, а не из базы на каждый запрос
+user_cache = UserCache()
+# отрисованные таблицы страниц рейтинга по (номер страницы, версия таблицы лидеров)
+page_cache = PageCache()
+PERIOD_TITLES = {'day': 'Рейтинг за день', 'week': 'Рейтинг за неделю', 'month': 'Рейтинг за месяц'}
+# неудачные попытки входа по логину и адресу. Считаются в памяти каждого процесса-обработчика,
+# поэтому при N процессах лимиты в сумме в N раз больше
+login_limiter = LoginLimiter()
+# сессии базы данных живут один запрос и закрываются после него
+app.teardown_appcontext(db_session.close_request_sessions)
 
 
 @login_manager.user_loader
 def load_user(user_id):
+    return user_cache.get(int(user_id), _load_user)
+
+
+def _load_user(user_id):
+    '''Пользователь отсоединяется от сессии, чтобы его можно было хранить в кэше между запросами'''
     db_sess = db_session.create_session()
-    return db_sess.query(User).get(user_id)
+    try:
+        user = db_sess.query(User).get(user_id)
+        if user is not None:
+            db_sess.expunge(user)
+        return user
+    finally:
+        db_sess.close()
 
 
 @app.route('/logout')
@@ -50,11 +92,28 @@ def login():
     clear_session()
     form = LoginForm()
     if form.is_submitted():
-        db_sess = db_session.create_session()
+        ip = request.remote_addr
+        if not login_limiter.allowed(form.login.data, ip):
+            # при переборе паролей хэш даже не считается
+            return render_template('login.html',
+                                   message="Слишком много попыток входа, попробуйте позже",
+                                   form=form, title='Авторизация'), 429
+        db_sess = db_session.request_session()
         user = db_sess.query(User).filter(User.login == form.login.data).first()
-        if user and user.check_password(form.password.data):
-            login_user(user, remember=form.remember_me.data)
-            return redirect("/")
+        try:
+            if user and password_hasher.check(user.hashed_password, form.password.data):
+                login_limiter.succeeded(form.login.data, ip)
+                if password_hasher.needs_rehash(user.hashed_password):
+                    # параметры хэширования поменялись, хэш обновляется, пока известен пароль
+                    user.hashed_password = password_hasher.hash(form.password.data)
+                    db_sess.commit()
+                    user_cache.invalidate(user.id)
+                login_user(user, remember=form.remember_me.data)
+                return redirect("/")
+        except PasswordHasherBusy:
+            return render_template('login.html', message="Сервер перегружен, попробуйте позже",
+                                   form=form, title='Авторизация'), 503
+        login_limiter.failed(form.login.data, ip)
         return render_template('login.html',
                                message="Неправильный логин или пароль",
                                form=form, title='Авторизация')
@@ -72,7 +131,7 @@ def edit(user_id):
     clear_session()
     if current_user.is_authenticated and current_user._get_current_object().is_admin:
         form = RegistrationForm()
-        db_sess = db_session.create_session()
+        db_sess = db_session.request_session()
         user = db_sess.query(User).filter(User.id == user_id).first()
         if not form.is_submitted():
             # Если не нажата кнопка на странице редактирования
@@ -88,9 +147,17 @@ def edit(user_id):
             user.rating = form.rating.data
             user.matches_number = form.matches_number.data
             if form.password.data:
-                user.set_password(form.password.data)
+                try:
+                    user.hashed_password = password_hasher.hash(form.password.data)
+                except PasswordHasherBusy:
+                    # изменения не сохраняются, сессия откатится после запроса
+                    form.password.errors = ('Сервер перегружен, попробуйте позже',)
+                    return render_template('edit.html', title='Редактирование', form=form), 503
             db_sess.add(user)
             db_sess.commit()
+            user_cache.invalidate(user_id)
+            player_top.update_user(user)
+            update_windows.update_user(user)
             return redirect('/admin/0')
         return render_template('edit.html', title='Редактирование', form=form)
     else:
@@ -103,7 +170,7 @@ def delete(user_id):
     clear_session()
     if current_user.is_authenticated and current_user._get_current_object().is_admin:
         form = DeleteForm()
-        db_sess = db_session.create_session()
+        db_sess = db_session.request_session()
         user = db_sess.query(User).filter(User.id == user_id).first()
         if not user:
             form.confirm.errors = ('Пользователь уже удален',)
@@ -112,6 +179,9 @@ def delete(user_id):
                 # Проверка на совпадение числа в label и числа в поле
                 db_sess.delete(user)
                 db_sess.commit()
+                user_cache.invalidate(user_id)
+                player_top.remove_user(user_id)
+                update_windows.remove_user(user_id)
                 return redirect('/admin/0')
             else:
                 form.confirm.errors = ('Числа не совпадают',)
@@ -128,38 +198,61 @@ def admin_():
 
 @app.route('/admin/<int:page_number>', methods=['GET', 'POST'])
 def admin(page_number=0):
-    '''Админка. Имеется поиск пользователей по параметрам. Все параметры ищутся только на вхождение подстрок.
-    Все найденные пользователи отображаются на 1 странице, сколько бы их не было.'''
+    '''Админка. Имеется поиск пользователей по параметрам. Логин и ник ищутся на вхождение подстрок,
+    рейтинг и количество матчей - по началу числа. Найденные пользователи разбиваются на страницы,
+    параметры поиска передаются в адресе страницы.'''
     clear_session()
     if current_user.is_authenticated and current_user._get_current_object().is_admin:
         form = SearchForm()
         if request.method == 'POST':
-            if form.login or form.nickname or form.rating or form.matches_number:
-                if not form.rating.data:
-                    search_rating = ''
-                else:
-                    search_rating = str(form.rating.data)
-                if not form.matches_number.data:
-                    search_matches_number = ''
-                else:
-                    search_matches_number = str(form.matches_number.data)
-                rating_list = []
-                for user in player_top.global_top_player:
-                    if (form.login.data in user[3] and
-                            form.nickname.data in user[0] and
-                            search_rating in user[1] and
-                            search_matches_number in user[2]):
-                        rating_list.append(user)
-            else:
-                rating_list = player_top.global_top_player[20 * page_number:20 * (page_number + 1)]
+            search = {'login': form.login.data, 'nickname': form.nickname.data,
+                      'rating': form.rating.data, 'matches_number': form.matches_number.data}
+            search = {name: value for name, value in search.items() if value not in (None, '')}
+            return redirect('/admin/0' + ('?' + urlencode(search) if search else ''))
+        search = {name: request.args.get(name, '') for name in ('login', 'nickname', 'rating', 'matches_number')}
+        # поля формы заполняются текущими параметрами поиска
+        form.login.data = search['login']
+        form.nickname.data = search['nickname']
+        form.rating.data = search['rating']
+        form.matches_number.data = search['matches_number']
+        found = player_top.search_users(**search)
+        if found is None:
+            rating_list = player_top.leaderboard.page(page_number)
+            found_number = len(player_top.leaderboard)
+            query = ''
         else:
-            rating_list = player_top.global_top_player[20 * page_number:20 * (page_number + 1)]
+            rating_list = [player_top.leaderboard.get(user_id) for user_id in found[20 * page_number:20 * (page_number + 1)]]
+            rating_list = [user for user in rating_list if user]
+            found_number = len(found)
+            query = '?' + urlencode({name: value for name, value in search.items() if value})
 
         return render_template('admin.html',
                                rating_list=rating_list,
-                               page_number=page_number,
-                               max_page_number=player_top.global_top_player_len // 20 +
-                                               bool(player_top.global_top_player_len % 20), title='админка', form=form)
+                               page_number=page_number, query=query,
+                               max_page_number=found_number // 20 + bool(found_number % 20),
+                               title='админка', form=form)
+    else:
+        return 'Вы не администратор!'
+
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    '''Метрики: время обработки маршрутов, число и время SQL-запросов, размер cookie сессии,
+    время перестройки таблицы лидеров, а также статистика кэша пользователей'''
+    clear_session()
+    if current_user.is_authenticated and current_user._get_current_object().is_admin:
+        return render_template('metrics.html', metrics_table=metrics.table(), user_cache=user_cache.stats(),
+                               page_cache=page_cache.stats(),
+                               title='Метрики')
+    else:
+        return 'Вы не администратор!'
+
+
+@app.route('/admin/metrics.txt')
+def admin_metrics_text():
+    '''Метрики в текстовом формате Prometheus'''
+    if current_user.is_authenticated and current_user._get_current_object().is_admin:
+        return Response(metrics.render_text(), mimetype='text/plain; version=0.0.4')
     else:
         return 'Вы не администратор!'
 
@@ -170,20 +263,21 @@ def register():
     clear_session()
     form = RegistrationForm()
     if form.is_submitted():
-        db_sess = db_session.create_session()
+        db_sess = db_session.request_session()
         user = User()
         user.nickname = form.nickname.data
         user.login = form.login.data
-        if form.password.data:
-            user.set_password(form.password.data)
-        else:
+        if not form.password.data:
             form.login.errors = ('Пароль не может быть пустым',)
             return render_template('register.html', title='Регистрация', form=form)
-        if form.password.data == form.repeat_password.data:
-            user.set_password(form.password.data)
-        else:
+        if form.password.data != form.repeat_password.data:
             form.repeat_password.errors = ('Пароли должны совпадать',)
             return render_template('register.html', title='Регистрация', form=form)
+        try:
+            user.hashed_password = password_hasher.hash(form.password.data)
+        except PasswordHasherBusy:
+            form.login.errors = ('Сервер перегружен, попробуйте позже',)
+            return render_template('register.html', title='Регистрация', form=form), 503
 
         db_sess.add(user)
         try:
@@ -192,6 +286,7 @@ def register():
             if 'user.login' in str(e):
                 form.login.errors = ('Пользователь с таким логином существует',)
             return render_template('register.html', title='Регистрация', form=form)
+        player_top.update_user(user)
         return redirect('/login')
     return render_template('register.html', title='Регистрация', form=form)
 
@@ -204,8 +299,8 @@ def not_authenticated():
 
 @app.route('/personal_page', methods=['GET', 'POST'])
 def personal_page():
-    '''Страница отображает ник, логин, рейтинг, кол-во матчей пользователя.
-     Также отображаются последние игры пользователя.
+    '''Страница отображает ник, логин, рейтинг, кол-во матчей пользователя, его место в рейтинге
+     и соседей по таблице. Также отображаются последние игры пользователя, более старые игры листаются по ссылке.
      Если пользователь - администратор, также присутсвует кнопка войти в админку.'''
     clear_session()
     if not current_user.is_authenticated:
@@ -215,20 +310,23 @@ def personal_page():
         login = current_user.login
         matches_number = current_user.matches_number
         rating = current_user.rating
-        db_sess = db_session.create_session()
-        user_game_list = db_sess.query(Games).filter(Games.user_id == current_user.id)
-        if len(list(user_game_list)) > 20:
-            user_game_list = user_game_list[:20]
-        game_and_rounds_list = []
-        for game in user_game_list:
-            rounds_list = []
-            for round_id in (game.round1, game.round2, game.round3, game.round4, game.round5):
-                round = db_sess.query(Rounds).filter(Rounds.id == round_id).first()
-                rounds_list.append(round)
-            game_and_rounds_list.append((game, rounds_list))
+        before_id = request.args.get('before', None, type=int)
+        db_sess = db_session.read_session()
+        game_and_rounds_list, has_more = history.load_games(db_sess, current_user.id, limit=20, before_id=before_id)
+        # итоги старых игр, перенесенных в архив (scheduled/compact_history.py)
+        archived = db_sess.query(UserStats).get(current_user.id)
+        # место в таблице и по 5 игроков выше и ниже
+        rank, around = player_top.leaderboard.around(current_user.id, 5)
+        if player_top.read_only and rank is not None:
+            # пользователь в кэше этого процесса может быть старее снимка, рейтинг и матчи берутся
+            # из той же строки таблицы, что и место
+            _, rating, matches_number, _, _ = around[rank - max(rank - 5, 0)]
         return render_template('personal_page.html', nickname=nickname,
+                               rank=rank, around=around, around_start=max(rank - 5, 0) if around else 0,
+                               archived=archived,
                                login=login, matches_number=matches_number, rating=rating, current_user=current_user,
-                               user_game_list=game_and_rounds_list, title='Личная информация')
+                               user_game_list=game_and_rounds_list, has_more=has_more, before_id=before_id,
+                               title='Личная информация')
 
 
 @app.route('/global_rating')
@@ -242,105 +340,165 @@ def rating_():
 @app.route('/global_rating/<int:page_number>')
 def rating(page_number=0):
     clear_session()
-    return render_template('rating.html',
-                           rating_list=[(nickname, raitng, matches_number) for nickname, raitng, matches_number, _, _ in
-                                        player_top.global_top_player[20 * page_number:20 * (page_number + 1)]],
-                           page_number=page_number,
-                           max_page_number=player_top.global_top_player_len // 20 +
-                                           bool(player_top.global_top_player_len % 20), title='Рейтинг')
+    return rating_page(player_top.leaderboard, page_number, '/global_rating', 'Рейтинг')
+
+
+@app.route('/rating/<period>')
+def period_rating_(period):
+    clear_session()
+    return redirect(f'/rating/{period}/0')
+
+
+@app.route('/rating/<period>/<int:page_number>')
+def period_rating(period, page_number=0):
+    '''Рейтинг за текущий день, неделю или месяц: лучшая игра за период и количество игр за период'''
+    clear_session()
+    board = update_windows.get(period)
+    if board is None:
+        abort(404)
+    return rating_page(board.leaderboard, page_number, f'/rating/{period}', PERIOD_TITLES[period], period)
+
+
+def rating_page(leaderboard, page_number, base_url, heading, cache_key=''):
+    '''Таблица страницы отрисовывается один раз для каждой версии таблицы лидеров и дальше берется из кэша.
+    Шапка страницы (base.html) зависит от пользователя, поэтому она отрисовывается каждый раз.
+    Если у браузера уже есть эта версия страницы (ETag или Last-Modified), отвечаем 304 без тела.'''
+    version = leaderboard.version
+    # ник в шапке меняется только при редактировании, а оно меняет и версию таблицы
+    etag = f'{cache_key}{version}-{page_number}-{current_user.id if current_user.is_authenticated else 0}'
+    last_modified = datetime.datetime.fromtimestamp(int(leaderboard.updated), datetime.timezone.utc)
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        rating_table = page_cache.get((cache_key, page_number, version), lambda: render_template(
+            'rating_table.html',
+            rating_list=[(nickname, raitng, matches_number) for nickname, raitng, matches_number, _, _ in
+                         leaderboard.page(page_number)],
+            page_number=page_number, base_url=base_url, heading=heading,
+            max_page_number=leaderboard.page_count()))
+        # страница рейтинга, на которой находится текущий пользователь
+        rank = leaderboard.rank(current_user.id) if current_user.is_authenticated else None
+        response = make_response(render_template('rating.html', rating_table=rating_table,
+                                                 page_number=page_number, base_url=base_url,
+                                                 periods=PERIOD_TITLES,
+                                                 my_page=rank // 20 if rank is not None else None,
+                                                 title=heading))
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # браузер хранит страницу, но перед показом каждый раз сверяет ее с сервером
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
 
 
 @app.route('/game', methods=['GET', 'POST'])
 def game():
-    '''Отображает страницу с игрой и результатами раундов/игр'''
-    db_sess = db_session.create_session()
+    '''Отображает страницу с игрой и результатами раундов/игр.
+    Игра хранится на сервере (см. data/game_state.py), в cookie сессии лежит только ее ключ'''
     form = ConfirmPlace()  # Кнопка отправки выбранных координат
-    if request.method == "GET":
-        # выбираются рандомные координаты из базы данных
-        p = random.randint(1, db_sess.query(PanoramaPoints).count())
-        p = db_sess.query(PanoramaPoints).filter(PanoramaPoints.id == p).first()
-        y = p.y
-        x = p.x
-        y = float(y)
-        x = float(x)
-        y += random.randint(-100, 100) / 10000
-        x += random.randint(-100, 100) / 10000
-        session["x"] = x
-        session["y"] = y
+    key = session.get('game')
+    state = game_states.get(key)
+    if state is None or state['round'] >= 5:
+        if request.method == 'POST':
+            # игра закончилась (или прямо сейчас записывается) или устарела, ответ на ее раунд не засчитывается
+            return redirect('/game')
+        # новая игра: из пула точек в памяти сразу выбираются 5 разных точек, далеко друг от друга,
+        # координаты немного сдвигаются
+        points = [(point_id, y + random.randint(-100, 100) / 10000, x + random.randint(-100, 100) / 10000)
+                  for point_id, y, x in update_points.get_pool().sample_many(
+                      5, min_distance_km=app.config['ROUND_SPREAD_KM'])]
+        key, state = game_states.start(points)
+        session['game'] = key
+    point_id, y, x = state['points'][state['round']]
     if form.validate_on_submit():
-        # из сессии считываются число раундов, раунды и счет
-        gamenum = session.get('gamenum', 0)
-        gamescore = session.get('gamescore', 0)
-        rounds = session.get('rounds', [])
-        x = session.get("x", 0)
-        y = session.get("y", 0)
-        gamenum += 1
         coords = [float(i) for i in form.rating.data.split(", ")]
         dist = getdistance([y, x], coords)
-        if dist:
-            score = max(int((5000 - dist) / 5), 0)
-            gamescore += score
+        score = round_score(dist)
+        round_index = state['round']
+        state['score'] += score
+        state['round'] += 1
+        gamenum, gamescore = state['round'], state['score']
+        if current_user.is_authenticated:
+            # если пользователь авторизирован то запоминаем его раунд и счет.
+            # В базу данных раунды попадут вместе со всей игрой
+            state['rounds'].append([y, x, coords[0], coords[1], score, point_id])
+        if not game_states.advance(key, state, round_index):
+            # этот раунд уже засчитан параллельным запросом (двойная отправка формы)
+            return redirect('/game')
+        if gamenum < 5:
+            # если игра из 5 раундов все еще идет
+            return render_template('roundresult.html', dist=dist, score=score,
+                                   y1=coords[1], x1=coords[0], y2=x, x2=y,
+                                   gamescore=gamescore, gamenum=gamenum)
+        else:
+            # если игра закончилась
             if current_user.is_authenticated:
-                # если пользователь авторизирован то записываем его раунд и счет в базу данных
-                curround = Rounds()
-                curround.start_point = f"{x},{y}"
-                curround.user_input_point = f"{coords[1]},{coords[0]}"
-                curround.rating = score
-                db_sess.add(curround)
-                db_sess.commit()
-                roundid = curround.id
-                rounds.append(roundid)
-                session["rounds"] = rounds
-            if gamenum != 5:
-                # если игра из 5 раундов все еще идет
-                session["gamenum"] = gamenum
-                session["gamescore"] = gamescore
-                return render_template('roundresult.html', dist=dist, score=score,
-                                       y1=coords[1], x1=coords[0], y2=x, x2=y,
-                                       gamescore=gamescore, gamenum=gamenum)
-            else:
-                # если игра закончилась
-                if current_user.is_authenticated:
-                    # если пользователь авторизирован то записываем его игру и счет в базу данных
-                    curgame = Games()
-                    userid = current_user._get_current_object().id
-                    curgame.round1 = rounds[0]
-                    curgame.round2 = rounds[1]
-                    curgame.round3 = rounds[2]
-                    curgame.round4 = rounds[3]
-                    curgame.round5 = rounds[4]
-                    curgame.rating = gamescore
-                    curgame.user_id = userid
-                    db_sess.add(curgame)
-                    db_sess.commit()
-                    if gamescore > int(current_user._get_current_object().rating):
-                        current_user._get_current_object().rating = gamescore
-                    db_sess.merge(current_user._get_current_object())
-                    db_sess.commit()
-                    current_user._get_current_object().matches_number = current_user._get_current_object().matches_number + 1
-                    db_sess.merge(current_user._get_current_object())
-                    db_sess.commit()
-                clear_session()
-                return render_template('gameresult.html', dist=dist, score=score,
-                                       y1=coords[1], x1=coords[0], y2=x, x2=y,
-                                       gamescore=gamescore, gamenum=gamenum)
-    else:
-        return render_template('game.html', coords=f"{y}, {x}", form=form)
+                # если пользователь авторизирован то записываем его игру и счет в базу данных:
+                # пять раундов, игра и статистика пользователя пишутся одной транзакцией
+                game_writer.save(current_user.id, state['rounds'], gamescore)
+            clear_session()
+            return render_template('gameresult.html', dist=dist, score=score,
+                                   y1=coords[1], x1=coords[0], y2=x, x2=y,
+                                   gamescore=gamescore, gamenum=gamenum)
+    return render_template('game.html', coords=f"{y}, {x}", form=form)
 
 
 def clear_session():
-    '''Обнуляет число раундов, раунды и счет'''
-    session["gamenum"] = 0
-    session["gamescore"] = 0
-    session["rounds"] = []
-
-
-db_session.global_init("db/panorama_db.sqlite")
-
-# Именно тут, а не вверху. При импортировании модуля выполняется код. Код обращается к базе данных.
-import scheduled.update_top as player_top
-
-# создается поток, чтобы обновлять список пользователей
-update_top_th = threading.Thread(target=player_top.schedule_update)
-update_top_th.start()
-app.run()
+    '''Прерывает незаконченную игру: удаляет ее состояние и ключ из сессии.
+    Cookie меняется, только если в ней была игра'''
+    game_states.finish(session.pop('game', None))
+    # раньше игра хранилась в самой cookie, старые ключи убираются
+    for name in LEGACY_SESSION_KEYS:
+        session.pop(name, None)
+
+
+def games_saved(user_ids):
+    '''После записи игры новые рейтинг и количество матчей сразу попадают в таблицу лидеров,
+    а устаревшие пользователи удаляются из кэша'''
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+    player_top.update_users(user_ids)
+    update_windows.follow()
+
+
+game_writer = None
+game_states = None
+password_hasher = None
+LEGACY_SESSION_KEYS = ('gamenum', 'gamescore', 'rounds', 'points', 'x', 'y')
+
+
+def create_app(db_file='db/panorama_db.sqlite', leaderboard_snapshot=None, game_state_db=None):
+    '''Подключает базу данных, метрики, таблицу лидеров, пул точек и запись игр, возвращает приложение.
+    Вызывается один раз в каждом процессе: при запуске main.py или из wsgi.py.
+    Если задан leaderboard_snapshot, таблица лидеров не строится в этом процессе, а читается из снимка,
+    который публикует python -m scheduled.publish_top (так работают несколько процессов-обработчиков).
+    Незаконченные игры хранятся в памяти процесса или, если задан game_state_db, в отдельном файле SQLite,
+    общем для всех процессов.'''
+    global game_writer, game_states, password_hasher
+    db_session.global_init(db_file)
+    init_metrics(app, [db_session.get_engine(), db_session.get_read_engine()])
+    if app.config['TRUSTED_PROXIES']:
+        # request.remote_addr - адрес клиента, а не прокси
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                                x_proto=app.config['TRUSTED_PROXIES'])
+    player_top.init(leaderboard_snapshot)
+    if leaderboard_snapshot:
+        # новый снимок подхватывается перед запросом, проверка файла не чаще раза в полсекунды
+        app.before_request(player_top.leaderboard.refresh)
+        user_cache.ttl = app.config['SHARED_USER_CACHE_TTL']
+    update_points.update_points()
+    update_windows.rebuild()
+    game_writer = GameWriter(on_saved=games_saved, background=app.config['GAME_WRITE_BEHIND'])
+    game_states = GameStates(SqliteStore(game_state_db) if game_state_db else MemoryStore())
+    password_hasher = PasswordHasher(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'])
+    return app
+
+
+if __name__ == '__main__':
+    # Сервер разработки в одном процессе. Для нескольких процессов см. wsgi.py.
+    # Создается поток, который периодически сверяет таблицу лидеров с базой данных
+    create_app()
+    update_top_th = threading.Thread(target=player_top.schedule_update)
+    update_top_th.start()
+    app.run()
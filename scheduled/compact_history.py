@@ -0,0 +1,212 @@
+'''Перенос старых игр и раундов в архив.
+
+Игры старше --days дней вместе с раундами дописываются в сжатые файлы архива, по файлу на месяц игры
+(archive/games-2024-01.jsonl.gz, одна игра с раундами на строку). Итоги этих игр прибавляются
+к статистике пользователя (data/user_stats.py), после чего игры и раунды удаляются из базы.
+Рейтинг и количество матчей пользователя хранятся в таблице user и не меняются.
+Архивные игры и раунды scheduled/rescore.py не пересчитывает, лучшая из них учитывается
+в рейтинге через user_stats.best_game_rating.
+
+Работа идет пачками по --batch игр, каждая пачка - отдельная короткая транзакция, поэтому запись
+новых игр не ждет долго. После каждой пачки освобожденные страницы возвращаются файлу базы
+через PRAGMA incremental_vacuum, если в базе включен auto_vacuum=INCREMENTAL. В старой базе
+его нужно один раз включить флагом --enable-incremental-vacuum (выполняется VACUUM всей базы,
+на время которого база заблокирована).
+
+Пачка сначала дописывается в архив и только потом удаляется из базы. Если команду прервать
+между этими шагами, при следующем запуске игры пачки попадут в архив второй раз,
+read_archive пропускает такие повторы.
+
+Запуск:
+    python -m scheduled.compact_history compact [--days 180] [--archive archive] [--batch 500]
+    python -m scheduled.compact_history cat archive/games-2024-01.jsonl.gz
+'''
+import argparse
+import datetime
+import gzip
+import json
+import os
+import time
+
+import sqlalchemy
+from sqlalchemy.dialects.sqlite import insert
+
+from data import db_session
+from data.games import Games
+from data.rounds import Rounds
+from data.user_stats import UserStats
+
+# месячный рейтинг строится по играм текущего месяца, их архивировать нельзя
+MIN_DAYS = 32
+VACUUM_PAGES = 1000
+
+
+def partition_path(folder, date):
+    return os.path.join(folder, f'games-{date:%Y-%m}.jsonl.gz')
+
+
+def append_games(folder, games):
+    '''Дописывает игры в файлы архива по месяцам. Каждая дозапись - отдельный член gzip,
+    gzip.open читает такие файлы целиком как один поток'''
+    partitions = {}
+    for game in games:
+        partitions.setdefault(partition_path(folder, game['date']), []).append(game)
+    os.makedirs(folder, exist_ok=True)
+    for path, partition in partitions.items():
+        with gzip.open(path, 'at', encoding='utf-8') as file:
+            for game in partition:
+                file.write(json.dumps({**game, 'date': game['date'].isoformat(sep=' ')}, ensure_ascii=False) + '\n')
+        with open(path, 'rb+') as file:
+            os.fsync(file.fileno())
+
+
+def read_archive(paths):
+    '''Игры из файлов архива по одной, без чтения файлов целиком. Повторы одной игры пропускаются'''
+    for path in paths:
+        seen = set()
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            for line in file:
+                game = json.loads(line)
+                if game['id'] not in seen:
+                    seen.add(game['id'])
+                    yield game
+
+
+def load_batch(db_sess, cutoff, last_id, batch):
+    games = (db_sess.query(Games.id, Games.user_id, Games.rating, Games.modifed_date)
+             .filter(Games.modifed_date < cutoff, Games.id > last_id)
+             .order_by(Games.id).limit(batch).all())
+    rounds = {}
+    if games:
+        for row in (db_sess.query(Rounds.game_id, Rounds.round_index, Rounds.start_lat, Rounds.start_lon,
+                                  Rounds.input_lat, Rounds.input_lon, Rounds.rating, Rounds.point_id)
+                    .filter(Rounds.game_id.in_([game.id for game in games]))
+                    .order_by(Rounds.game_id, Rounds.round_index)):
+            rounds.setdefault(row.game_id, []).append(
+                {'round_index': row.round_index, 'start_lat': row.start_lat, 'start_lon': row.start_lon,
+                 'input_lat': row.input_lat, 'input_lon': row.input_lon, 'rating': row.rating,
+                 'point_id': row.point_id})
+    return [{'id': game.id, 'user_id': game.user_id, 'rating': game.rating, 'date': game.modifed_date,
+             'rounds': rounds.get(game.id, [])} for game in games]
+
+
+def user_totals(games):
+    totals = {}
+    for game in games:
+        if game['user_id'] is None:
+            continue
+        total = totals.setdefault(game['user_id'], {
+            'user_id': game['user_id'], 'archived_games': 0, 'archived_rounds': 0, 'games_rating_sum': 0,
+            'best_game_rating': 0, 'rounds_rating_sum': 0,
+            'first_game_date': game['date'], 'last_game_date': game['date']})
+        total['archived_games'] += 1
+        total['archived_rounds'] += len(game['rounds'])
+        total['games_rating_sum'] += game['rating'] or 0
+        total['best_game_rating'] = max(total['best_game_rating'], game['rating'] or 0)
+        total['rounds_rating_sum'] += sum(r['rating'] or 0 for r in game['rounds'])
+        total['first_game_date'] = min(total['first_game_date'], game['date'])
+        total['last_game_date'] = max(total['last_game_date'], game['date'])
+    return list(totals.values())
+
+
+def save_totals(db_sess, totals):
+    '''Прибавляет итоги пачки к статистике пользователей (INSERT ... ON CONFLICT DO UPDATE)'''
+    if not totals:
+        return
+    statement = insert(UserStats).values(totals)
+    table = UserStats.__table__
+    db_sess.execute(statement.on_conflict_do_update(index_elements=[UserStats.user_id], set_={
+        'archived_games': table.c.archived_games + statement.excluded.archived_games,
+        'archived_rounds': table.c.archived_rounds + statement.excluded.archived_rounds,
+        'games_rating_sum': table.c.games_rating_sum + statement.excluded.games_rating_sum,
+        'best_game_rating': sqlalchemy.func.max(table.c.best_game_rating, statement.excluded.best_game_rating),
+        'rounds_rating_sum': table.c.rounds_rating_sum + statement.excluded.rounds_rating_sum,
+        'first_game_date': sqlalchemy.func.min(table.c.first_game_date, statement.excluded.first_game_date),
+        'last_game_date': sqlalchemy.func.max(table.c.last_game_date, statement.excluded.last_game_date)}))
+
+
+def compact(days=180, folder='archive', batch=500, pause=0.05):
+    if days < MIN_DAYS:
+        raise ValueError(f'Архивировать можно игры старше {MIN_DAYS} дней')
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    engine = db_session.get_engine()
+    with engine.connect() as connection:
+        incremental = connection.execute(sqlalchemy.text('PRAGMA auto_vacuum')).scalar() == 2
+    if not incremental:
+        print('В базе не включен auto_vacuum=INCREMENTAL, место в файле освободится только после VACUUM '
+              '(см. --enable-incremental-vacuum)')
+    archived_games = archived_rounds = 0
+    last_id = 0
+    while True:
+        db_sess = db_session.create_session()
+        try:
+            games = load_batch(db_sess, cutoff, last_id, batch)
+            if not games:
+                break
+            last_id = games[-1]['id']
+            append_games(folder, games)
+            ids = [game['id'] for game in games]
+            save_totals(db_sess, user_totals(games))
+            db_sess.query(Rounds).filter(Rounds.game_id.in_(ids)).delete(synchronize_session=False)
+            db_sess.query(Games).filter(Games.id.in_(ids)).delete(synchronize_session=False)
+            db_sess.commit()
+        finally:
+            db_sess.close()
+        archived_games += len(games)
+        archived_rounds += sum(len(game['rounds']) for game in games)
+        if incremental:
+            incremental_vacuum(engine, VACUUM_PAGES)
+        # между пачками база свободна для записи игр
+        time.sleep(pause)
+    if incremental:
+        # остаток свободных страниц
+        incremental_vacuum(engine)
+    return archived_games, archived_rounds
+
+
+def incremental_vacuum(engine, pages=None):
+    '''Возвращает файлу базы до pages свободных страниц (все, если pages не задан).
+    Каждый шаг запроса освобождает одну страницу, а execute в sqlite3 делает только первый шаг,
+    поэтому запрос выполняется через executescript, который доводит его до конца'''
+    connection = engine.raw_connection()
+    try:
+        connection.executescript(f'PRAGMA incremental_vacuum({pages or 0})')
+    finally:
+        connection.close()
+
+
+def enable_incremental_vacuum():
+    '''Включает auto_vacuum=INCREMENTAL в существующей базе. Требует полного VACUUM'''
+    with db_session.get_engine().connect() as connection:
+        connection.execute(sqlalchemy.text('PRAGMA auto_vacuum=INCREMENTAL'))
+        connection.execute(sqlalchemy.text('VACUUM'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Архивирование старых игр и раундов')
+    parser.add_argument('--db', default='db/panorama_db.sqlite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('compact', help='перенести старые игры в архив')
+    command.add_argument('--days', type=int, default=180, help='архивировать игры старше стольких дней')
+    command.add_argument('--archive', default='archive', help='папка архива')
+    command.add_argument('--batch', type=int, default=500, help='игр в одной транзакции')
+    command.add_argument('--pause', type=float, default=0.05, help='секунд между пачками')
+    command.add_argument('--enable-incremental-vacuum', action='store_true',
+                         help='сначала включить auto_vacuum=INCREMENTAL (VACUUM всей базы)')
+    command = commands.add_parser('cat', help='вывести игры из файлов архива')
+    command.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'cat':
+        for game in read_archive(args.paths):
+            print(json.dumps(game, ensure_ascii=False))
+        return
+    db_session.global_init(args.db)
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+    games, rounds = compact(args.days, args.archive, args.batch, args.pause)
+    print(f'Перенесено в архив игр: {games}, раундов: {rounds}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+'''Импорт точек панорам и выгрузка данных большими потоками.
+
+Импорт точек из CSV (столбцы lat/lon, latitude/longitude или y/x) или GeoJSON
+(FeatureCollection или GeoJSON по одному объекту в строке). Координаты проверяются,
+точки ближе --dedup-km друг к другу и к уже существующим точкам пропускаются
+(расстояние считается как в getdistance). Вставка идет пачками по --batch строк.
+
+Выгрузка точек (CSV или GeoJSON), таблицы лидеров (CSV) и истории игр (CSV или JSON по строкам).
+Строки читаются из базы курсором частями, файл пишется по мере чтения. Если имя файла
+заканчивается на .gz, файл сжимается.
+
+Файлы читаются и пишутся потоком, память не зависит от их размера. Исключение - проверка
+на дубликаты: для нее в памяти держится сетка координат уже принятых точек (--dedup-km 0 ее отключает).
+
+Запуск:
+    python -m scheduled.data_io import-points points.csv [--dedup-km 0.05]
+    python -m scheduled.data_io export-points points.geojson
+    python -m scheduled.data_io export-leaderboard top.csv.gz
+    python -m scheduled.data_io export-history history.jsonl [--user 15]
+'''
+import argparse
+import csv
+import gzip
+import json
+import math
+
+import sqlalchemy
+
+from data import db_session
+from data.games import Games
+from data.panorama_points import PanoramaPoints
+from data.rounds import Rounds
+from data.spatial_index import SpatialIndex
+from data.users import User
+
+LAT_NAMES = ('lat', 'latitude', 'y')
+LON_NAMES = ('lon', 'lng', 'long', 'longitude', 'x')
+
+
+def open_file(path, mode):
+    '''Открывает файл в текстовом режиме, файлы .gz сжимаются'''
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def file_format(path, default):
+    name = path[:-3] if path.endswith('.gz') else path
+    for extension, name_format in (('.csv', 'csv'), ('.geojson', 'geojson'), ('.json', 'geojson'),
+                                   ('.jsonl', 'jsonl'), ('.ndjson', 'jsonl')):
+        if name.endswith(extension):
+            return name_format
+    return default
+
+
+def read_csv_points(file):
+    reader = csv.DictReader(file)
+    fields = {name.strip().lower(): name for name in reader.fieldnames or ()}
+    lat = next((fields[name] for name in LAT_NAMES if name in fields), None)
+    lon = next((fields[name] for name in LON_NAMES if name in fields), None)
+    if lat is None or lon is None:
+        raise ValueError(f'В CSV нет столбцов широты и долготы: {reader.fieldnames}')
+    for row in reader:
+        yield row[lat], row[lon]
+
+
+def read_geojson_points(file, chunk_size=1 << 16):
+    '''Точки из GeoJSON. FeatureCollection разбирается по одному объекту из массива features,
+    не читая файл целиком, ключи type, crs, bbox и другие могут стоять до или после features.
+    Поддерживается и GeoJSON по одному объекту в строке.'''
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size)
+    position = 0
+
+    def skip(chars):
+        nonlocal buffer, position
+        while True:
+            while position < len(buffer) and buffer[position] in chars:
+                position += 1
+            if position < len(buffer):
+                return True
+            more = file.read(chunk_size)
+            if not more:
+                return False
+            buffer, position = buffer[position:] + more, 0
+
+    def decode():
+        nonlocal buffer, position
+        skip(' \t\r\n')
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # число в конце буфера могло прерваться посередине
+                if end < len(buffer) or isinstance(value, (dict, list)):
+                    position = end
+                    return value
+            except json.JSONDecodeError:
+                pass
+            more = file.read(chunk_size)
+            if not more:
+                value, position = decoder.raw_decode(buffer, position)
+                return value
+            buffer, position = buffer[position:] + more, 0
+
+    def expect(char):
+        nonlocal position
+        if not skip(' \t\r\n') or buffer[position] != char:
+            raise ValueError(f'Ошибка в GeoJSON: ожидался символ {char!r}')
+        position += 1
+
+    def features():
+        '''Точки из массива features по одному объекту'''
+        nonlocal position
+        expect('[')
+        while skip(' \t\r\n,'):
+            if buffer[position] == ']':
+                position += 1
+                return
+            yield from feature_points(decode())
+        raise ValueError('Ошибка в GeoJSON: массив features не закончен')
+
+    # объект верхнего уровня читается по ключам: массив features (в любом месте объекта) разбирается
+    # потоком, остальные ключи целиком. Объект без features - это отдельный объект или геометрия
+    while skip(' \t\r\n\x1e'):
+        if buffer[position] != '{':
+            yield from feature_points(decode())
+            continue
+        position += 1
+        fields, has_features = {}, False
+        while True:
+            if not skip(' \t\r\n,'):
+                raise ValueError('Ошибка в GeoJSON: объект не закончен')
+            if buffer[position] == '}':
+                position += 1
+                break
+            name = decode()
+            expect(':')
+            if name == 'features':
+                has_features = True
+                yield from features()
+            else:
+                fields[name] = decode()
+        if not has_features:
+            yield from feature_points(fields)
+
+
+def feature_points(feature):
+    '''Точки объекта GeoJSON. Объект без геометрии дает точку без координат (она считается неправильной),
+    на геометриях без точек (линии, многоугольники) бросается ValueError'''
+    if not isinstance(feature, dict):
+        raise ValueError(f'Ошибка в GeoJSON: ожидался объект, а не {type(feature).__name__}')
+    if feature.get('type') == 'FeatureCollection':
+        for item in feature.get('features') or ():
+            yield from feature_points(item)
+        return
+    geometry = feature.get('geometry') if feature.get('type') == 'Feature' else feature
+    if not geometry:
+        yield None, None
+    elif geometry.get('type') == 'Point':
+        lon, lat = geometry['coordinates'][:2]
+        yield lat, lon
+    elif geometry.get('type') == 'MultiPoint':
+        for lon, lat, *_ in geometry['coordinates']:
+            yield lat, lon
+    elif geometry.get('type') == 'GeometryCollection':
+        for item in geometry.get('geometries') or ():
+            yield from feature_points(item)
+    else:
+        raise ValueError(f"Неподдерживаемый тип геометрии GeoJSON: {geometry.get('type')}")
+
+
+def valid_point(lat, lon):
+    '''(широта, долгота) числами или None, если координаты неправильные'''
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def import_points(path, dedup_km=0.05, batch=5000, point_format=None):
+    point_format = point_format or file_format(path, 'csv')
+    engine = db_session.get_engine()
+    # сетка с клеткой примерно в расстояние дубликатов
+    grid = SpatialIndex(dedup_km / 111) if dedup_km > 0 else None
+    if grid is not None:
+        with engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(
+                sqlalchemy.select(PanoramaPoints.y, PanoramaPoints.x))
+            for rows in iter(lambda: result.fetchmany(batch), []):
+                for lat, lon in rows:
+                    grid.add(None, lat, lon)
+
+    insert = PanoramaPoints.__table__.insert()
+    stats = {'imported': 0, 'invalid': 0, 'duplicates': 0}
+    rows = []
+    with open_file(path, 'r') as file:
+        points = read_csv_points(file) if point_format == 'csv' else read_geojson_points(file)
+        for lat, lon in points:
+            point = valid_point(lat, lon)
+            if point is None:
+                stats['invalid'] += 1
+                continue
+            if grid is not None:
+                if grid.has_near(*point, dedup_km):
+                    stats['duplicates'] += 1
+                    continue
+                grid.add(None, *point)
+            rows.append({'y': point[0], 'x': point[1]})
+            if len(rows) >= batch:
+                with engine.begin() as connection:
+                    connection.execute(insert, rows)
+                stats['imported'] += len(rows)
+                rows = []
+    if rows:
+        with engine.begin() as connection:
+            connection.execute(insert, rows)
+        stats['imported'] += len(rows)
+    return stats
+
+
+def stream_rows(statement, batch=5000):
+    '''Строки запроса частями, без чтения результата целиком'''
+    with db_session.get_engine().connect() as connection:
+        result = connection.execution_options(stream_results=True).execute(statement)
+        for rows in iter(lambda: result.fetchmany(batch), []):
+            yield from rows
+
+
+def export_points(path, point_format=None):
+    point_format = point_format or file_format(path, 'csv')
+    rows = stream_rows(sqlalchemy.select(PanoramaPoints.id, PanoramaPoints.y, PanoramaPoints.x)
+                       .order_by(PanoramaPoints.id))
+    count = 0
+    with open_file(path, 'w') as file:
+        if point_format == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(('id', 'lat', 'lon'))
+            for count, row in enumerate(rows, 1):
+                writer.writerow(row)
+        else:
+            file.write('{"type": "FeatureCollection", "features": [\n')
+            for count, (point_id, lat, lon) in enumerate(rows, 1):
+                if count > 1:
+                    file.write(',\n')
+                file.write(json.dumps({'type': 'Feature', 'id': point_id, 'properties': {},
+                                       'geometry': {'type': 'Point', 'coordinates': [lon, lat]}}))
+            file.write('\n]}\n')
+    return count
+
+
+def export_leaderboard(path):
+    '''Таблица лидеров в том же порядке, что и на сайте: (-рейтинг, количество матчей, id)'''
+    rating = sqlalchemy.func.coalesce(User.rating, 0)
+    matches_number = sqlalchemy.func.coalesce(User.matches_number, 0)
+    rows = stream_rows(sqlalchemy.select(User.id, User.nickname, rating, matches_number)
+                       .order_by(rating.desc(), matches_number, User.id))
+    count = 0
+    with open_file(path, 'w') as file:
+        writer = csv.writer(file)
+        writer.writerow(('place', 'id', 'nickname', 'rating', 'matches_number'))
+        for count, row in enumerate(rows, 1):
+            writer.writerow((count, *row))
+    return count
+
+
+def export_history(path, user_id=None, history_format=None):
+    '''История игр: одна строка на раунд вместе с данными игры'''
+    history_format = history_format or file_format(path, 'csv')
+    columns = ('game_id', 'user_id', 'game_date', 'game_rating', 'round_index',
+               'start_lat', 'start_lon', 'input_lat', 'input_lon', 'round_rating', 'point_id')
+    statement = sqlalchemy.select(Games.id, Games.user_id, Games.modifed_date, Games.rating, Rounds.round_index,
+                                  Rounds.start_lat, Rounds.start_lon, Rounds.input_lat, Rounds.input_lon,
+                                  Rounds.rating, Rounds.point_id).join(Rounds, Rounds.game_id == Games.id)
+    if user_id is not None:
+        statement = statement.where(Games.user_id == user_id)
+    rows = stream_rows(statement.order_by(Games.id, Rounds.round_index))
+    count = 0
+    with open_file(path, 'w') as file:
+        if history_format == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(columns)
+        for count, row in enumerate(rows, 1):
+            row = list(row)
+            row[2] = row[2].isoformat(sep=' ') if row[2] else None
+            if history_format == 'csv':
+                writer.writerow(row)
+            else:
+                file.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Импорт точек и выгрузка данных')
+    parser.add_argument('--db', default='db/panorama_db.sqlite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('import-points', help='импорт точек из CSV или GeoJSON')
+    command.add_argument('path')
+    command.add_argument('--format', choices=('csv', 'geojson'))
+    command.add_argument('--dedup-km', type=float, default=0.05,
+                         help='точки ближе этого расстояния считаются дубликатами (0 - не проверять)')
+    command.add_argument('--batch', type=int, default=5000)
+    command = commands.add_parser('export-points', help='выгрузка точек в CSV или GeoJSON')
+    command.add_argument('path')
+    command.add_argument('--format', choices=('csv', 'geojson'))
+    command = commands.add_parser('export-leaderboard', help='выгрузка таблицы лидеров в CSV')
+    command.add_argument('path')
+    command = commands.add_parser('export-history', help='выгрузка истории игр в CSV или JSON по строкам')
+    command.add_argument('path')
+    command.add_argument('--format', choices=('csv', 'jsonl'))
+    command.add_argument('--user', type=int, help='только игры этого пользователя')
+    args = parser.parse_args()
+
+    db_session.global_init(args.db)
+    if args.command == 'import-points':
+        stats = import_points(args.path, args.dedup_km, args.batch, args.format)
+        print(f"Добавлено точек: {stats['imported']}, неправильных: {stats['invalid']}, "
+              f"дубликатов: {stats['duplicates']}")
+    elif args.command == 'export-points':
+        print(f'Выгружено точек: {export_points(args.path, args.format)}')
+    elif args.command == 'export-leaderboard':
+        print(f'Выгружено пользователей: {export_leaderboard(args.path)}')
+    else:
+        print(f'Выгружено раундов: {export_history(args.path, args.user, args.format)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+'''Средняя ошибка игроков по точкам панорам и по регионам.
+
+Точка раунда берется из rounds.point_id. У старых раундов его нет, а координаты цели сдвинуты случайно
+(до 0.01 градуса), поэтому для них точкой считается ближайшая к цели по сетке точек (data/spatial_index.py)
+не дальше --max-km. В плотных местах это может быть соседняя точка. Ошибка раунда - расстояние
+от цели до ответа (как при подсчете очков), считается numpy сразу для пачки раундов.
+Раунды читаются из базы частями, в памяти только точки и суммы по ним.
+
+Результат - два CSV, отсортированные от худших к лучшим: по точкам (id, широта, долгота, раундов,
+средняя ошибка в км) и по регионам - клеткам --region-size градусов, как в пуле точек.
+
+Запуск: python -m scheduled.guess_stats [--points point_errors.csv] [--regions region_errors.csv]
+'''
+import argparse
+import csv
+import math
+
+import sqlalchemy
+
+from data import db_session
+from data.panorama_points import PanoramaPoints
+from data.rounds import Rounds
+from data.scoring import batch_distance
+from data.spatial_index import SpatialIndex
+from scheduled.data_io import stream_rows
+
+# клетка сетки для поиска точки раунда: сдвиг цели намного меньше клетки
+INDEX_CELL = 0.05
+
+
+def guess_stats(chunk=10000, max_km=5):
+    '''Словарь id точки -> [широта, долгота, раундов, сумма ошибок] и число раундов без точки
+    (точка удалена или, у старых раундов, не нашлась рядом с целью)'''
+    index = SpatialIndex(INDEX_CELL)
+    stats = {}
+    for point_id, lat, lon in stream_rows(sqlalchemy.select(PanoramaPoints.id, PanoramaPoints.y, PanoramaPoints.x)):
+        index.add(point_id, lat, lon)
+        stats[point_id] = [lat, lon, 0, 0.0]
+    unmatched = 0
+    rows = stream_rows(sqlalchemy.select(Rounds.point_id, Rounds.start_lat, Rounds.start_lon,
+                                         Rounds.input_lat, Rounds.input_lon)
+                       .where(Rounds.start_lat.isnot(None), Rounds.input_lat.isnot(None)), chunk)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk:
+            unmatched += _add_batch(index, stats, batch, max_km)
+            batch = []
+    if batch:
+        unmatched += _add_batch(index, stats, batch, max_km)
+    return stats, unmatched
+
+
+def _add_batch(index, stats, batch, max_km):
+    point_ids, start_lat, start_lon, input_lat, input_lon = zip(*batch)
+    errors = batch_distance(start_lat, start_lon, input_lat, input_lon)
+    unmatched = 0
+    for point_id, lat, lon, error in zip(point_ids, start_lat, start_lon, errors.tolist()):
+        if point_id is None:
+            nearest = index.nearest(lat, lon, 1, max_km)
+            point_id = nearest[0][1] if nearest else None
+        point = stats.get(point_id)
+        if point is None:
+            unmatched += 1
+            continue
+        point[2] += 1
+        point[3] += error
+    return unmatched
+
+
+def region_stats(stats, region_size=1.0):
+    '''Суммы по регионам: (клетка по широте, клетка по долготе) -> [раундов, сумма ошибок]'''
+    regions = {}
+    for lat, lon, count, total in stats.values():
+        if count:
+            region = regions.setdefault((math.floor(lat / region_size), math.floor(lon / region_size)), [0, 0.0])
+            region[0] += count
+            region[1] += total
+    return regions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Средняя ошибка игроков по точкам и регионам')
+    parser.add_argument('--db', default='db/panorama_db.sqlite')
+    parser.add_argument('--points', default='point_errors.csv')
+    parser.add_argument('--regions', default='region_errors.csv')
+    parser.add_argument('--region-size', type=float, default=1.0, help='размер региона в градусах')
+    parser.add_argument('--max-km', type=float, default=5, help='наибольшее расстояние от цели раунда до точки')
+    parser.add_argument('--chunk', type=int, default=10000)
+    parser.add_argument('--top', type=int, default=10, help='сколько худших точек и регионов вывести')
+    args = parser.parse_args()
+    db_session.global_init(args.db)
+
+    stats, unmatched = guess_stats(args.chunk, args.max_km)
+    points = sorted(((total / count, point_id, lat, lon, count)
+                     for point_id, (lat, lon, count, total) in stats.items() if count), reverse=True)
+    regions = sorted(((total / count, region, count) for region, (count, total)
+                      in region_stats(stats, args.region_size).items()), reverse=True)
+    with open(args.points, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(('point_id', 'lat', 'lon', 'rounds', 'avg_error_km'))
+        for error, point_id, lat, lon, count in points:
+            writer.writerow((point_id, lat, lon, count, round(error, 3)))
+    with open(args.regions, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(('region_lat', 'region_lon', 'rounds', 'avg_error_km'))
+        for error, (i, j), count in regions:
+            writer.writerow((i * args.region_size, j * args.region_size, count, round(error, 3)))
+
+    print(f'Раундов учтено: {sum(point[4] for point in points)}, без точки: {unmatched}')
+    print('Худшие точки:')
+    for error, point_id, lat, lon, count in points[:args.top]:
+        print(f'  {point_id} ({lat:.4f}, {lon:.4f}): {error:.1f} км, раундов {count}')
+    print('Худшие регионы:')
+    for error, (i, j), count in regions[:args.top]:
+        print(f'  {i * args.region_size}, {j * args.region_size}: {error:.1f} км, раундов {count}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+'''Перевод старой базы на новое хранение раундов.
+
+Раньше у игры было пять столбцов round1..round5 со ссылками на раунды, а координаты раунда
+хранились строками "x,y" (долгота, широта) в start_point и user_input_point. Теперь у раунда есть
+game_id, номер раунда round_index и числовые столбцы start_lat, start_lon, input_lat, input_lon,
+а также id точки панорамы point_id (у старых раундов он пустой).
+
+Команда добавляет новые столбцы, затем частями по id переносит ссылки из games и разбирает строки
+координат. Таблицы целиком в память не читаются, каждая часть коммитится отдельно, поэтому миграцию
+можно прервать и запустить снова. Старые столбцы остаются в таблицах, приложение их больше не читает.
+
+Запуск: python -m scheduled.migrate_rounds [--db db/panorama_db.sqlite] [--chunk 10000]
+'''
+import argparse
+import sqlalchemy
+
+from data import db_session
+
+NEW_COLUMNS = (
+    ('game_id', 'INTEGER REFERENCES games(id)'),
+    ('round_index', 'INTEGER'),
+    ('start_lat', 'FLOAT'),
+    ('start_lon', 'FLOAT'),
+    ('input_lat', 'FLOAT'),
+    ('input_lon', 'FLOAT'),
+    ('point_id', 'INTEGER'),
+)
+
+
+def table_columns(connection, table):
+    return {row[1] for row in connection.execute(sqlalchemy.text(f'PRAGMA table_info("{table}")'))}
+
+
+def add_columns(engine):
+    '''Добавляет в rounds недостающие столбцы'''
+    with engine.begin() as connection:
+        columns = table_columns(connection, 'rounds')
+        for name, column_type in NEW_COLUMNS:
+            if name not in columns:
+                connection.execute(sqlalchemy.text(f'ALTER TABLE rounds ADD COLUMN {name} {column_type}'))
+
+
+def link_rounds(engine, chunk):
+    '''Проставляет раундам game_id и round_index по столбцам round1..round5 игр'''
+    select = sqlalchemy.text('SELECT id, round1, round2, round3, round4, round5 FROM games '
+                             'WHERE id > :last ORDER BY id LIMIT :chunk')
+    update = sqlalchemy.text('UPDATE rounds SET game_id = :game_id, round_index = :round_index '
+                             'WHERE id = :round_id AND game_id IS NULL')
+    last_id = 0
+    linked = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select, {'last': last_id, 'chunk': chunk}).fetchall()
+            if not rows:
+                return linked
+            last_id = rows[-1][0]
+            params = [{'game_id': row[0], 'round_index': i, 'round_id': round_id}
+                      for row in rows for i, round_id in enumerate(row[1:]) if round_id is not None]
+            if params:
+                connection.execute(update, params)
+                linked += len(params)
+
+
+def parse_point(point):
+    '''Строка "x,y" (долгота, широта) -> (широта, долгота) или None, если строка испорчена'''
+    try:
+        x, y = point.split(',')
+        return float(y), float(x)
+    except (AttributeError, ValueError):
+        return None
+
+
+def convert_points(engine, chunk):
+    '''Разбирает строки координат в числовые столбцы'''
+    select = sqlalchemy.text('SELECT id, start_point, user_input_point FROM rounds '
+                             'WHERE id > :last AND start_lat IS NULL ORDER BY id LIMIT :chunk')
+    update = sqlalchemy.text('UPDATE rounds SET start_lat = :start_lat, start_lon = :start_lon, '
+                             'input_lat = :input_lat, input_lon = :input_lon WHERE id = :id')
+    last_id = 0
+    converted = 0
+    while True:
+        with engine.begin() as connection:
+            rows = connection.execute(select, {'last': last_id, 'chunk': chunk}).fetchall()
+            if not rows:
+                return converted
+            last_id = rows[-1][0]
+            params = []
+            for round_id, start_point, user_input_point in rows:
+                start, user_input = parse_point(start_point), parse_point(user_input_point)
+                if start and user_input:
+                    params.append({'id': round_id, 'start_lat': start[0], 'start_lon': start[1],
+                                   'input_lat': user_input[0], 'input_lon': user_input[1]})
+            if params:
+                connection.execute(update, params)
+                converted += len(params)
+
+
+def migrate(chunk=10000):
+    engine = db_session.get_engine()
+    add_columns(engine)
+    with engine.connect() as connection:
+        games_columns = table_columns(connection, 'games')
+        rounds_columns = table_columns(connection, 'rounds')
+    if 'round1' not in games_columns and 'start_point' not in rounds_columns:
+        print('База уже в новом формате')
+    if 'round1' in games_columns:
+        print(f'Обработано ссылок на раунды: {link_rounds(engine, chunk)}')
+    if 'start_point' in rounds_columns:
+        print(f'Переведено координат: {convert_points(engine, chunk)}')
+    db_session.create_indexes(engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Перевод раундов на числовые столбцы и game_id')
+    parser.add_argument('--db', default='db/panorama_db.sqlite')
+    parser.add_argument('--chunk', type=int, default=10000)
+    args = parser.parse_args()
+    db_session.global_init(args.db)
+    migrate(args.chunk)
+
+
+if __name__ == '__main__':
+    main()
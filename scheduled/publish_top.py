@@ -0,0 +1,87 @@
+'''Процесс, который строит таблицу лидеров и публикует ее снимок для обработчиков.
+
+Когда приложение работает в нескольких процессах (см. wsgi.py), держать в каждом процессе свою
+копию таблицы и свою перестройку по базе дорого. Вместо этого таблицу ведет только этот процесс:
+раз в --interval секунд он находит новые игры и новых пользователей (по возрастанию id),
+перечитывает изменившихся пользователей и, если таблица поменялась, пишет новый снимок
+(data/leaderboard_snapshot.py). Раз в REBUILD_INTERVAL_MINUTES таблица полностью сверяется с базой,
+так в нее попадают и правки из админки.
+
+Запуск: python -m scheduled.publish_top [--db db/panorama_db.sqlite] [--snapshot db/leaderboard.snapshot]
+'''
+import argparse
+import time
+
+import schedule
+import sqlalchemy
+
+from data import db_session
+from data.games import Games
+from data.leaderboard_snapshot import write_snapshot
+from data.users import User
+import scheduled.update_top as player_top
+
+
+class Publisher:
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+        self.published = None  # версия таблицы в последнем снимке
+        self.snapshot_version = 0
+        db_sess = db_session.create_session()
+        try:
+            self.last_game = db_sess.query(sqlalchemy.func.max(Games.id)).scalar() or 0
+            self.last_user = db_sess.query(sqlalchemy.func.max(User.id)).scalar() or 0
+        finally:
+            db_sess.close()
+
+    def follow(self):
+        '''Переносит в таблицу пользователей, которые сыграли или зарегистрировались с прошлой проверки'''
+        db_sess = db_session.create_session()
+        try:
+            games = db_sess.query(Games.id, Games.user_id).filter(Games.id > self.last_game).all()
+            users = db_sess.query(User.id).filter(User.id > self.last_user).all()
+        finally:
+            db_sess.close()
+        if games:
+            self.last_game = max(game_id for game_id, _ in games)
+        if users:
+            self.last_user = max(user_id for user_id, in users)
+        changed = {user_id for _, user_id in games if user_id is not None} | {user_id for user_id, in users}
+        if changed:
+            player_top.update_users(changed)
+
+    def publish(self):
+        '''Пишет снимок, если таблица изменилась. Версия снимка - время в микросекундах,
+        чтобы она росла и после перезапуска этого процесса (по ней обработчики кэшируют страницы)'''
+        version, updated, rows = player_top.leaderboard.export()
+        if version == self.published:
+            return
+        self.snapshot_version = max(self.snapshot_version + 1, time.time_ns() // 1000)
+        write_snapshot(self.snapshot_path, self.snapshot_version, updated, rows)
+        self.published = version
+
+    def run(self, interval):
+        schedule.every(player_top.REBUILD_INTERVAL_MINUTES).minutes.do(player_top.update_top)
+        while True:
+            schedule.run_pending()
+            self.follow()
+            self.publish()
+            time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Публикация снимка таблицы лидеров для обработчиков')
+    parser.add_argument('--db', default='db/panorama_db.sqlite')
+    parser.add_argument('--snapshot', default='db/leaderboard.snapshot')
+    parser.add_argument('--interval', type=float, default=1, help='секунд между проверками')
+    args = parser.parse_args()
+    db_session.global_init(args.db)
+    player_top.init(with_search=False)
+    publisher = Publisher(args.snapshot)
+    publisher.publish()
+    print(f'Снимок таблицы лидеров: {args.snapshot}, пользователей {len(player_top.leaderboard)}')
+    publisher.run(args.interval)
+
+
+if __name__ == '__main__':
+    main()
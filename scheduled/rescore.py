@@ -0,0 +1,101 @@
+'''Пересчет очков за старые раунды после изменения формулы в data/scoring.py.
+
+Раунды читаются частями по id (без OFFSET), очки считаются пачкой через numpy,
+измененные строки записываются одной транзакцией на часть. Затем пересчитываются
+Games.rating (сумма раундов игры) и, по желанию, User.rating (лучшая игра).
+Память ограничена размером части.
+
+Пересчитываются только игры и раунды в базе. Игры, перенесенные в архив (scheduled/compact_history.py),
+и их итоги в user_stats не пересчитываются никогда: лучшая архивная игра входит в User.rating
+с очками по той формуле, по которой была сыграна.
+
+Запуск: python -m scheduled.rescore [--db db/panorama_db.sqlite] [--chunk 10000] [--users]
+'''
+import argparse
+import numpy as np
+import sqlalchemy
+
+from data import db_session
+from data.rounds import Rounds
+from data.scoring import batch_distance, batch_score
+
+
+def rescore_rounds(chunk=10000):
+    '''Пересчитывает Rounds.rating. Возвращает число измененных раундов'''
+    changed = 0
+    last_id = 0
+    db_sess = db_session.create_session()
+    try:
+        while True:
+            rows = db_sess.query(Rounds.id, Rounds.rating, Rounds.start_lat, Rounds.start_lon,
+                                 Rounds.input_lat, Rounds.input_lon).filter(
+                Rounds.id > last_id, Rounds.start_lat.isnot(None), Rounds.input_lat.isnot(None)).order_by(
+                Rounds.id).limit(chunk).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            # координаты уже числовые, поэтому часть целиком переводится в массив без разбора строк
+            table = np.array(rows, dtype=np.float64)
+            ids = table[:, 0].astype(np.int64)
+            ratings = table[:, 1]
+            scores = batch_score(batch_distance(table[:, 2], table[:, 3], table[:, 4], table[:, 5]))
+            changed_rows = np.nonzero(scores != ratings)[0]
+            mappings = [{'id': int(ids[i]), 'rating': int(scores[i])} for i in changed_rows]
+            if mappings:
+                db_sess.bulk_update_mappings(Rounds, mappings)
+                db_sess.commit()
+                changed += len(mappings)
+    finally:
+        db_sess.close()
+    return changed
+
+
+def rescore_games(chunk=10000):
+    '''Games.rating = сумма очков за раунды игры. Обновление идет диапазонами id'''
+    _update_by_ranges('games', '''
+        UPDATE games SET rating = (
+            SELECT COALESCE(SUM(rounds.rating), 0) FROM rounds WHERE rounds.game_id = games.id)
+        WHERE games.id > :low AND games.id <= :high''', chunk)
+
+
+def rescore_users(chunk=10000):
+    '''User.rating = лучшая игра пользователя, вместе с лучшей игрой из архива (user_stats.best_game_rating).
+    У пользователей без игр рейтинг не меняется'''
+    _update_by_ranges('user', '''
+        UPDATE user SET rating = (
+            SELECT MAX(best) FROM (
+                SELECT MAX(games.rating) AS best FROM games WHERE games.user_id = user.id
+                UNION ALL
+                SELECT user_stats.best_game_rating FROM user_stats WHERE user_stats.user_id = user.id))
+        WHERE user.id > :low AND user.id <= :high
+        AND (EXISTS (SELECT 1 FROM games WHERE games.user_id = user.id)
+             OR EXISTS (SELECT 1 FROM user_stats WHERE user_stats.user_id = user.id))''', chunk)
+
+
+def _update_by_ranges(table, statement, chunk):
+    statement = sqlalchemy.text(statement)
+    db_sess = db_session.create_session()
+    try:
+        max_id = db_sess.execute(sqlalchemy.text(f'SELECT MAX(id) FROM "{table}"')).scalar() or 0
+        for low in range(0, max_id, chunk):
+            db_sess.execute(statement, {'low': low, 'high': low + chunk})
+            db_sess.commit()
+    finally:
+        db_sess.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пересчет очков за раунды и игры')
+    parser.add_argument('--db', default='db/panorama_db.sqlite')
+    parser.add_argument('--chunk', type=int, default=10000)
+    parser.add_argument('--users', action='store_true', help='также пересчитать рейтинг пользователей')
+    args = parser.parse_args()
+    db_session.global_init(args.db)
+    print(f'Изменено раундов: {rescore_rounds(args.chunk)}')
+    rescore_games(args.chunk)
+    if args.users:
+        rescore_users(args.chunk)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import schedule
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from data.panorama_points import PanoramaPoints
+from data.point_pool import PointPool
+from data import db_session
+
+# Точки панорам держатся в памяти. Пул перечитывается после коммита, который менял таблицу точек,
+# а раз в минуту дополнительно сверяется с базой (на случай изменений из других процессов).
+# Первый раз пул загружается при первом обращении (get_pool) или явно вызовом update_points().
+point_pool = PointPool()
+_fingerprint = None
+
+
+def update_points():
+    '''Перечитывает все точки из базы данных'''
+    global _fingerprint
+    db_sess = db_session.create_session()
+    try:
+        _fingerprint = _get_fingerprint(db_sess)
+        point_pool.load(db_sess.query(PanoramaPoints.id, PanoramaPoints.y, PanoramaPoints.x))
+    finally:
+        db_sess.close()
+
+
+def _get_fingerprint(db_sess):
+    return tuple(db_sess.query(sqlalchemy.func.count(PanoramaPoints.id), sqlalchemy.func.max(PanoramaPoints.id),
+                               sqlalchemy.func.total(PanoramaPoints.x + PanoramaPoints.y)).one())
+
+
+def check_points():
+    '''Перечитывает точки, если таблица изменилась'''
+    db_sess = db_session.create_session()
+    try:
+        changed = _get_fingerprint(db_sess) != _fingerprint
+    finally:
+        db_sess.close()
+    if changed or point_pool.dirty:
+        update_points()
+
+
+def get_pool():
+    '''Пул точек для выбора раунда. Перечитывается только если таблица точек менялась'''
+    if point_pool.dirty:
+        update_points()
+    return point_pool
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_points_changed(db_sess, flush_context):
+    for obj in (*db_sess.new, *db_sess.dirty, *db_sess.deleted):
+        if isinstance(obj, PanoramaPoints):
+            db_sess.info['panorama_points_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _reload_points(db_sess):
+    if db_sess.info.pop('panorama_points_changed', False):
+        point_pool.dirty = True
+
+
+# Задача выполняется общим циклом schedule в scheduled/update_top.schedule_update
+schedule.every().minute.do(check_points)
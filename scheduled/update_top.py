@@ -1,25 +1,99 @@
+import time
 import schedule
 from data.users import User
+from data.leaderboard import Leaderboard
+from data.leaderboard_snapshot import SnapshotLeaderboard
+from data.search_index import UserSearchIndex
 from data import db_session
+from data.metrics import metrics
 
-global_top_player = []
-global_top_player_len = 0
+# Таблица лидеров обновляется сразу при изменении пользователя (игра, редактирование, удаление).
+# Полная перестройка из базы данных осталась только как периодическая проверка согласованности.
+leaderboard = Leaderboard()
+# индекс для поиска в админке обновляется вместе с таблицей лидеров
+search_index = UserSearchIndex()
+REBUILD_INTERVAL_MINUTES = 10
+# Если таблица читается из снимка (несколько процессов-обработчиков, см. init), она только для чтения:
+# изменения пользователей подхватывает процесс scheduled.publish_top, а индекс поиска строится
+# по снимку не чаще раза в SEARCH_INDEX_SECONDS секунд.
+read_only = False
+SEARCH_INDEX_SECONDS = 60
+_search_index_built = (None, 0)  # (версия снимка, время построения индекса)
+
+
+def init(snapshot_path=None, with_search=True):
+    '''Строит таблицу лидеров по базе данных или, если задан snapshot_path, открывает ее снимок.
+    with_search=False - индекс поиска не нужен (процесс scheduled.publish_top ничего не ищет),
+    тогда он не держится в памяти и не перестраивается вместе с таблицей'''
+    global leaderboard, read_only
+    if snapshot_path:
+        leaderboard = SnapshotLeaderboard(snapshot_path)
+        read_only = True
+    else:
+        if with_search:
+            leaderboard.subscribe(search_index)
+        update_top()
 
 
 def update_top():
-    global global_top_player, global_top_player_len
+    '''Полностью перестраивает таблицу лидеров по базе данных'''
+    start = time.perf_counter()
     db_sess = db_session.create_session()
-    users = db_sess.query(User)
-    rating_list = [(user.nickname, str(user.rating), str(user.matches_number), user.login, user.id) for user in users]
-    rating_list.sort(key=lambda x: (-int(x[1]), int(x[2])))
-    global_top_player = rating_list
-    global_top_player_len = len(global_top_player)
+    try:
+        rows = db_sess.query(User.id, User.nickname, User.login, User.rating, User.matches_number)
+        leaderboard.rebuild(rows)
+    finally:
+        db_sess.close()
+    metrics.observe('leaderboard_refresh_seconds', time.perf_counter() - start)
+
+
+def update_user(user):
+    '''Переносит в таблицу лидеров изменения одного пользователя'''
+    if read_only:
+        return
+    leaderboard.update_user(user.id, user.nickname, user.login, user.rating, user.matches_number)
+
+
+def update_users(user_ids):
+    '''Перечитывает пользователей из базы данных и переносит их в таблицу лидеров'''
+    if read_only:
+        return
+    db_sess = db_session.create_session()
+    try:
+        for user in db_sess.query(User).filter(User.id.in_(user_ids)):
+            update_user(user)
+    finally:
+        db_sess.close()
+
+
+def remove_user(user_id):
+    if read_only:
+        return
+    leaderboard.remove_user(user_id)
+
+
+def search_users(login='', nickname='', rating='', matches_number=''):
+    '''id найденных пользователей в порядке рейтинга или None, если параметры поиска пустые'''
+    if read_only:
+        _refresh_search_index()
+    found = search_index.search(login, nickname, rating, matches_number)
+    if found is None:
+        return None
+    return leaderboard.sort_ids(found)
 
 
-update_top()
+def _refresh_search_index():
+    global _search_index_built
+    version, built = _search_index_built
+    if version is None or (version != leaderboard.version and time.monotonic() - built > SEARCH_INDEX_SECONDS):
+        search_index.rebuild(leaderboard.items())
+        _search_index_built = (leaderboard.version, time.monotonic())
 
 
 def schedule_update():
-    schedule.every().minute.do(update_top)
+    '''Цикл фоновых задач schedule. Полная перестройка таблицы не нужна, если таблица читается из снимка'''
+    if not read_only:
+        schedule.every(REBUILD_INTERVAL_MINUTES).minutes.do(update_top)
     while True:
         schedule.run_pending()
+        time.sleep(1)
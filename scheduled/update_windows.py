@@ -0,0 +1,90 @@
+import datetime
+import threading
+
+import schedule
+import sqlalchemy
+
+from data import db_session
+from data.games import Games
+from data.users import User
+from data.windowed_top import PERIODS, WindowedLeaderboard, period_start
+
+# Таблицы лидеров за день, неделю и месяц. При запуске они строятся запросом только по играм
+# текущего месяца (индекс по games.modifed_date), а дальше обновляются новыми играми:
+# follow читает игры с id больше последней учтенной, то есть только новые строки.
+# Так игры видны и из других процессов-обработчиков. Правки и удаление пользователей в админке
+# переносятся сразу (update_user, remove_user), но только в том процессе, где их сделали.
+# Поэтому раз в сутки таблицы перестраиваются целиком как сверка с базой.
+boards = {period: WindowedLeaderboard(period) for period in PERIODS}
+REBUILD_INTERVAL_HOURS = 24
+FOLLOW_INTERVAL_SECONDS = 5
+_lock = threading.Lock()
+_last_game = 0
+
+
+def rebuild():
+    '''Перестраивает все таблицы по играм текущих периодов'''
+    global _last_game
+    now = datetime.datetime.now()
+    with _lock:
+        db_sess = db_session.create_session()
+        try:
+            last_game = db_sess.query(sqlalchemy.func.max(Games.id)).scalar() or 0
+            for period, board in boards.items():
+                start = period_start(period, now)
+                rows = (db_sess.query(Games.user_id, User.nickname, User.login,
+                                      sqlalchemy.func.max(Games.rating), sqlalchemy.func.count(Games.id))
+                        .join(User, User.id == Games.user_id)
+                        .filter(Games.modifed_date >= start, Games.id <= last_game)
+                        .group_by(Games.user_id))
+                board.rebuild(start, rows)
+        finally:
+            db_sess.close()
+        _last_game = last_game
+
+
+def follow(chunk=1000):
+    '''Учитывает игры, записанные после последней проверки'''
+    global _last_game
+    with _lock:
+        for board in boards.values():
+            board.expire()
+        db_sess = db_session.create_session()
+        try:
+            while True:
+                games = (db_sess.query(Games.id, Games.user_id, User.nickname, User.login,
+                                       Games.rating, Games.modifed_date)
+                         .join(User, User.id == Games.user_id)
+                         .filter(Games.id > _last_game).order_by(Games.id).limit(chunk).all())
+                for game_id, user_id, nickname, login, rating, date in games:
+                    for board in boards.values():
+                        board.add_game(user_id, nickname, login, rating, date)
+                if games:
+                    _last_game = games[-1][0]
+                if len(games) < chunk:
+                    return
+        finally:
+            db_sess.close()
+
+
+def get(period):
+    '''Таблица лидеров периода или None, если такого периода нет'''
+    board = boards.get(period)
+    if board is not None:
+        board.expire()
+    return board
+
+
+def update_user(user):
+    '''Переносит в таблицы новые ник и логин пользователя'''
+    for board in boards.values():
+        board.update_user(user.id, user.nickname, user.login)
+
+
+def remove_user(user_id):
+    for board in boards.values():
+        board.remove_user(user_id)
+
+
+schedule.every(FOLLOW_INTERVAL_SECONDS).seconds.do(follow)
+schedule.every(REBUILD_INTERVAL_HOURS).hours.do(rebuild)
@@ -0,0 +1,29 @@
+'''Точка входа для WSGI-сервера с несколькими процессами, например:
+
+    python -m scheduled.publish_top --snapshot db/leaderboard.snapshot &
+    PANORAMA_LEADERBOARD_SNAPSHOT=db/leaderboard.snapshot gunicorn -w 4 --threads 8 wsgi:app
+
+Путь к базе, к снимку таблицы лидеров и к хранилищу незаконченных игр задаются переменными окружения
+PANORAMA_DB, PANORAMA_LEADERBOARD_SNAPSHOT и PANORAMA_GAME_STATE_DB, число обратных прокси перед
+обработчиками (например, 1 за nginx) - PANORAMA_TRUSTED_PROXIES. Хранилище игр - файл SQLite, общий
+для всех процессов (следующий раунд может попасть в другой процесс), по умолчанию game_state.sqlite
+рядом с базой.
+Таблица лидеров в обработчиках только читается из снимка, его пишет процесс scheduled.publish_top.
+Если снимок не задан, каждый процесс строит свою таблицу, как сервер разработки. Модуль нужно импортировать в каждом процессе-обработчике (без --preload),
+поток фоновых задач запускается при импорте.
+'''
+import os
+import threading
+
+from main import app as flask_app, create_app
+import scheduled.update_top as player_top
+
+# число обратных прокси перед обработчиками: адрес клиента берется из X-Forwarded-For (см. TRUSTED_PROXIES)
+flask_app.config['TRUSTED_PROXIES'] = int(os.environ.get('PANORAMA_TRUSTED_PROXIES', 0))
+
+db_file = os.environ.get('PANORAMA_DB', 'db/panorama_db.sqlite')
+# игры в памяти процесса здесь не подходят: раунды одной игры попадают в разные процессы
+game_state_db = os.environ.get('PANORAMA_GAME_STATE_DB') or os.path.join(os.path.dirname(db_file), 'game_state.sqlite')
+app = create_app(db_file, os.environ.get('PANORAMA_LEADERBOARD_SNAPSHOT') or None, game_state_db)
+# сверка пула точек с базой, а без снимка еще и перестройка таблицы лидеров
+threading.Thread(target=player_top.schedule_update, daemon=True).start()